@@ -9,12 +9,32 @@ import tempfile
 import shutil
 import subprocess
 import logging
+import logging.handlers
 import re
-import multiprocessing
 import time
+import traceback
 import datetime
+import functools
+import importlib.util
+import mmap
+import concurrent.futures
+import threading
+import collections
+import contextlib
+import copy
+import fnmatch
+import io
+import string
+import tarfile
+import json
 from pathlib import Path
 
+try:
+    import orjson # Optional: faster JSON for the HTML tree pages
+    def _json_dumps(obj): return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    _json_dumps = functools.partial(json.dumps, separators=(',', ':'), ensure_ascii=False) # Same output as orjson
+
 VERSION = "1.0.3"
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
@@ -31,6 +51,630 @@ AU_TEST_NEX_FN = "au_test.nex"
 AU_TEST_SCORE_FN = "au_test_results.txt"
 AU_LOG_FN = "paup_au.log"
 
+CONSTRAINT_BATCH_NEX_FN = "constraint_batch.nex"
+CONSTRAINT_BATCH_LOG_FN = "paup_constraint_batch.log"
+
+DEBUG_LOG_FN = "mldecay_debug.log" # With --debug, written in the temporary directory
+
+# RAM-backed scratch space for the many small PAUP* files, used when it has this much room
+SHM_DIR = Path("/dev/shm")
+SHM_MIN_FREE_BYTES = 1 << 30
+SITE_PLOT_POOL_MIN_CLADES = 4 # Below this, process start-up costs more than it saves
+SITE_HIST_BINS = 30
+SITE_HTML_THREADS = 4 # HTML tree pages written concurrently with site plotting
+SITE_DATA_ARCHIVE_FN = "site_data.tar" # Per-clade site tables, with --site-archive
+PAUP_SESSION_HANDSHAKE_SEC = 30 # A persistent PAUP* session must echo a sentinel this quickly
+
+# Taxon names containing whitespace or NEXUS punctuation must be quoted for PAUP*
+_TAXON_BAD_RE = re.compile(r'[\s()\[\]{}/\\,;=*`"\'<>:]')
+# --paup-block files: the block runs from "BEGIN PAUP;" to the first END; (or ENDBLOCK;), matched per line
+_PAUP_BLOCK_BEGIN_RE = re.compile(r'BEGIN\s+PAUP\s*;', re.IGNORECASE)
+_PAUP_BLOCK_END_RE = re.compile(r'\bEND(?:BLOCK)?\s*;', re.IGNORECASE)
+# Protein models PAUP* accepts by name in "lset protein="
+_PROTEIN_MODELS = frozenset(("JTT", "WAG", "LG", "DAYHOFF", "MTREV", "CPREV", "BLOSUM62", "HIVB", "HIVW"))
+
+# PAUP* score files: a header line naming the tree and likelihood columns, then data rows
+_LNL_HEADER_RE = re.compile(r'^(?=.*tree)(?=.*(?:-lnl|loglk|likelihood)).*$', re.IGNORECASE | re.MULTILINE)
+_LNL_ROW_RE = re.compile(r'^[ \t]*\S.*$', re.MULTILINE)
+_LNL_COLUMN_NAMES = ("-lnl", "loglk", "likelihood", "-loglk")
+_SITE_TREE_HEADER_RE = re.compile(r'(\d+)\t([-\d\.]+)\t-\t-') # Matched at the start of a line
+_SITE_LNL_RE = re.compile(r'\t\t(\d+)\t([-\d\.]+)')
+# One record per site comparing the ML tree with a constrained tree (site_data in the decay results)
+_SITE_DATA_DTYPE = np.dtype([('site', np.int64), ('lnL_ML', np.float64), ('lnL_constrained', np.float64),
+                             ('delta_lnL', np.float64), ('supports_branch', np.bool_)])
+# AU test table header in the lscores log output, e.g. "Tree  -ln L  Diff -ln L  AU"
+_AU_HEADER_RE = re.compile(r'^(?=.*Tree)(?=.*-ln\s*L)(?=.*\bAU\b)')
+_SPACED_LNL_RE = re.compile(r'-ln\s+L')
+# Fallback for a likelihood reported in a PAUP* log, matched against raw log bytes in one pass
+_LOG_LNL_RE = re.compile(rb'(?:-ln\s*L|likelihood|score)\s*=\s*([0-9.]+)', re.I)
+# Intermediate files removed by cleanup_intermediate_files, matched in one directory scan
+_INTERMEDIATE_FILE_PATTERNS = (
+    "*.cleaned",  # Cleaned tree files
+    "constraint_tree_*.tre",  # Constraint trees
+    "site_lnl_*.txt",  # Site likelihood files
+    "ml_tree_for_*_annotation.nwk",  # Temporary annotation tree files
+)
+_INTERMEDIATE_FILE_RE = re.compile("|".join(fnmatch.translate(p) for p in _INTERMEDIATE_FILE_PATTERNS))
+
+
+class PaupSession:
+    """
+    A long-lived PAUP* process that is fed commands over stdin.
+
+    The setup commands (typically executing the alignment and setting the model) run
+    once when the session starts. Each later block is followed by a PAUP* output
+    comment printing a unique sentinel, and output is read until that sentinel appears,
+    so many analyses can share one loaded alignment instead of starting PAUP* each time.
+
+    Before the setup commands, an empty block is sent as a handshake: a PAUP* build that
+    block-buffers its output on a pipe, or ignores stdin, never echoes the sentinel, so the
+    session fails fast with RuntimeError and the caller can run PAUP* once per script instead.
+    """
+
+    def __init__(self, paup_path, cwd: Path, setup_cmds: str, log_path: Path, timeout_sec: int = None,
+                 handshake_timeout_sec: int = PAUP_SESSION_HANDSHAKE_SEC):
+        self._counter = 0
+        self.process = subprocess.Popen(
+            [paup_path, "-n"],
+            cwd=str(cwd),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT # Binary pipes: output goes to the log undecoded
+        )
+        try:
+            try:
+                self.run("", log_path, timeout_sec=handshake_timeout_sec)
+            except subprocess.TimeoutExpired as e:
+                raise RuntimeError(f"PAUP* did not answer the session handshake within {handshake_timeout_sec}s") from e
+            self.run(setup_cmds, log_path, timeout_sec=timeout_sec)
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, commands: str, log_path: Path, timeout_sec: int = None):
+        """Sends a block of commands, writes its output to log_path and returns the output tail."""
+        self._counter += 1
+        sentinel = f"__MLDECAY_DONE_{self._counter}__".encode()
+        timed_out = threading.Event()
+
+        def on_timeout():
+            # Killing PAUP* closes its stdout, which unblocks the read loop below
+            timed_out.set()
+            self.process.kill()
+
+        watchdog = threading.Timer(timeout_sec, on_timeout) if timeout_sec else None
+        tail = collections.deque(maxlen=2000)
+        found = False
+        try:
+            if watchdog: watchdog.start()
+            self.process.stdin.write(f"{commands}\n[!{sentinel.decode()}]\n".encode())
+            self.process.stdin.flush()
+            with open(log_path, 'wb', buffering=1 << 16) as f_log:
+                for line in self.process.stdout:
+                    if line.strip() == sentinel: # The echoed command still has its brackets
+                        found = True
+                        break
+                    f_log.write(line)
+                    tail.append(line)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"PAUP* session terminated unexpectedly: {e}") from e
+        finally:
+            if watchdog: watchdog.cancel()
+        if not found:
+            if timed_out.is_set():
+                self.process.wait()
+                raise subprocess.TimeoutExpired(self.process.args, timeout_sec)
+            raise RuntimeError(f"PAUP* session ended before completing its commands (log: {log_path})")
+        return b"".join(tail).decode(errors='replace')
+
+    def close(self):
+        """Asks PAUP* to quit, killing it if it does not exit promptly."""
+        if self.alive:
+            try:
+                self.process.stdin.write(b"quit;\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            with contextlib.suppress(OSError): pipe.close()
+
+
+def _available_cpus():
+    """CPUs this process may run on: the affinity mask where supported, so taskset/cgroup pinning is respected."""
+    if hasattr(os, "sched_getaffinity"): return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@functools.lru_cache(maxsize=None)
+def _plotting_available():
+    """True if matplotlib and seaborn are installed; probed without importing them."""
+    return all(importlib.util.find_spec(name) is not None for name in ("matplotlib", "seaborn"))
+
+
+def _use_agg_backend():
+    """Select the non-interactive matplotlib backend in a site-plot worker process."""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render_site_plots(plot_tasks, output_dir, viz_format, hist_bins=SITE_HIST_BINS):
+    """
+    Draw the site likelihood bar plot and delta histogram for each clade.
+
+    Top-level so it can be sent to worker processes. Each task is
+    (clade_id, site_nums, deltas, taxa_display, info_text); one figure per plot
+    type is cleared and redrawn for each clade. hist_bins is a bin count or a
+    shared array of bin edges.
+
+    Returns:
+        List of (plot_path, hist_path) in task order
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    written = []
+    fig, ax_main = plt.subplots(figsize=(12, 6))
+    fig_hist, ax_hist = plt.subplots(figsize=(10, 5))
+    try:
+        for clade_id, site_nums, deltas, taxa_display, info_text in plot_tasks:
+            bar_positions = np.arange(len(deltas))
+
+            # Create standard site analysis plot
+            ax_main.cla()
+
+            # Create the main bar plot
+            bar_colors = np.where(deltas < 0, 'green', 'red')
+            ax_main.bar(bar_positions, deltas, color=bar_colors, alpha=0.7)
+
+            # Add x-axis ticks at reasonable intervals
+            if len(site_nums) > 50:
+                tick_interval = max(1, len(site_nums) // 20)
+                ax_main.set_xticks(bar_positions[::tick_interval])
+                ax_main.set_xticklabels(site_nums[::tick_interval].tolist(), rotation=45)
+            else:
+                ax_main.set_xticks(bar_positions)
+                ax_main.set_xticklabels(site_nums.tolist(), rotation=45)
+
+            # Add reference line at y=0
+            ax_main.axhline(y=0, color='black', linestyle='-', alpha=0.3)
+
+            # Add title that includes some taxa information
+            ax_main.set_title(f"Site-Specific Likelihood Differences for {clade_id} ({taxa_display})")
+            ax_main.set_xlabel("Site Position")
+            ax_main.set_ylabel("Delta lnL (ML - Constrained)")
+
+            # Add text box with summary info
+            ax_main.text(
+                0.02, 0.95, info_text,
+                transform=ax_main.transAxes,
+                bbox=dict(boxstyle='round', facecolor='white', alpha=0.8)
+            )
+
+            fig.tight_layout()
+
+            # Save plot in the requested format
+            plot_path = output_dir / f"site_plot_{clade_id}.{viz_format}"
+            fig.savefig(str(plot_path), dpi=150, format=viz_format)
+
+            # Optional: Create a histogram of delta values
+            ax_hist.cla()
+            sns.histplot(deltas, kde=True, bins=hist_bins, stat='count', ax=ax_hist)
+            ax_hist.axvline(x=0, color='black', linestyle='--')
+            ax_hist.set_title(f"Distribution of Site Likelihood Differences for {clade_id}")
+            ax_hist.set_xlabel("Delta lnL (ML - Constrained)")
+            fig_hist.tight_layout()
+
+            hist_path = output_dir / f"site_hist_{clade_id}.{viz_format}"
+            fig_hist.savefig(str(hist_path), dpi=150, format=viz_format)
+
+            written.append((plot_path, hist_path))
+    finally:
+        plt.close(fig)
+        plt.close(fig_hist)
+    return written
+
+
+def _read_fasta(path):
+    """
+    Reads a FASTA file in one call and returns (ids, data, spans).
+
+    spans holds the (start, end) byte offsets of each record's sequence lines in data,
+    so sequences are sliced out of the file contents without per-record parsing.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    ids, spans = [], []
+    pos = 0 if data[:1] == b'>' else data.find(b'\n>') # Skip anything before the first header
+    if pos > 0: pos += 1
+    while pos != -1:
+        header_end = data.find(b'\n', pos)
+        if header_end == -1: header_end = len(data)
+        next_pos = data.find(b'\n>', header_end)
+        header = data[pos + 1:header_end].split(None, 1)
+        ids.append(header[0].decode('utf-8') if header else "")
+        spans.append((header_end + 1, len(data) if next_pos == -1 else next_pos))
+        pos = -1 if next_pos == -1 else next_pos + 1
+    if not ids:
+        raise ValueError(f"No records found in FASTA file {path}")
+    return ids, data, spans
+
+
+class FastaAlignment:
+    """
+    Lean FASTA alignment: the file contents, taxon ids and per-record byte spans.
+
+    Supports the parts of Bio.Align.MultipleSeqAlignment this script relies on:
+    len(), get_alignment_length() and iteration over records with .id and .seq.
+    Sequences are sliced from the file contents when iterated; the (ntax, nchar)
+    uint8 matrix is only built if something asks for it.
+    """
+
+    Record = collections.namedtuple("Record", ["id", "seq"])
+
+    def __init__(self, ids, data, spans):
+        self.ids = ids
+        self._data = data
+        self._spans = spans
+        self._nchar = len(self._row(0))
+        if any(len(self._row(i)) != self._nchar for i in range(1, len(spans))):
+            raise ValueError("Sequences must all be the same length")
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(*_read_fasta(path))
+
+    def _row(self, i):
+        start, end = self._spans[i]
+        return self._data[start:end].translate(None, b' \t\r\n') # Join wrapped sequence lines
+
+    @functools.cached_property
+    def seqs(self):
+        """The alignment as an (ntax, nchar) uint8 matrix."""
+        rows = b"".join(self._row(i) for i in range(len(self._spans)))
+        return np.frombuffer(rows, dtype=np.uint8).reshape(len(self._spans), self._nchar)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i, taxon_id in enumerate(self.ids):
+            yield self.Record(taxon_id, self._row(i).decode('latin-1'))
+
+    def get_alignment_length(self):
+        return self._nchar
+
+
+# Interactive tree page; per-clade values are substituted by create_interactive_tree_html.
+# The optional table rows/sections are substituted with their own leading newline, or as empty strings.
+_HTML_TREE_TEMPLATE = string.Template(r"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>MLDecay - Interactive Tree for $clade_id</title>
+    <style>
+            body {
+                font-family: Arial, sans-serif;
+                line-height: 1.6;
+                color: #333;
+                max-width: 1200px;
+                margin: 0 auto;
+                padding: 20px;
+            }
+            h1, h2, h3 {
+                color: #2c3e50;
+            }
+            .container {
+                display: flex;
+                flex-wrap: wrap;
+                gap: 20px;
+            }
+            .tree-section {
+                flex: 1;
+                min-width: 500px;
+            }
+            .info-section {
+                flex: 1;
+                min-width: 300px;
+                background-color: #f8f9fa;
+                padding: 15px;
+                border-radius: 5px;
+            }
+            #tree_container {
+                width: 100%;
+                height: 600px;
+                border: 1px solid #ddd;
+                border-radius: 4px;
+                overflow: hidden;
+            }
+            .table {
+                width: 100%;
+                border-collapse: collapse;
+                margin-bottom: 15px;
+            }
+            .table th, .table td {
+                padding: 8px;
+                text-align: left;
+                border-bottom: 1px solid #ddd;
+            }
+            .table th {
+                background-color: #f2f2f2;
+            }
+            .highlight {
+                color: #e74c3c;
+                font-weight: bold;
+            }
+            .significant {
+                background-color: #d4edda;
+            }
+            .not-significant {
+                background-color: #f8d7da;
+            }
+            .buttons {
+                margin: 10px 0;
+            }
+            button {
+                background-color: #4CAF50;
+                color: white;
+                padding: 8px 12px;
+                border: none;
+                border-radius: 4px;
+                cursor: pointer;
+                margin-right: 5px;
+            }
+            button:hover {
+                background-color: #45a049;
+            }
+            .phylotree-node circle {
+                fill: #999;
+            }
+            .highlighted-node circle {
+                fill: #e74c3c !important;
+                r: 5 !important;
+            }
+            .highlighted-node text {
+                fill: #e74c3c !important;
+                font-weight: bold !important;
+            }
+            .highlighted-branch {
+                stroke: #e74c3c !important;
+                stroke-width: 3px !important;
+            }
+            .legend {
+                margin-top: 10px;
+                font-size: 0.9em;
+            }
+            .legend-item {
+                display: inline-block;
+                margin-right: 15px;
+            }
+            .legend-color {
+                display: inline-block;
+                width: 12px;
+                height: 12px;
+                margin-right: 5px;
+                vertical-align: middle;
+            }
+            .download-links {
+                margin-top: 20px;
+            }
+            .download-links a {
+                display: inline-block;
+                margin-right: 10px;
+                padding: 5px 10px;
+                background-color: #f8f9fa;
+                border: 1px solid #ddd;
+                border-radius: 3px;
+                text-decoration: none;
+                color: #333;
+            }
+            .download-links a:hover {
+                background-color: #e9ecef;
+            }
+        </style>
+$js_imports
+</head>
+<body>
+    <h1>MLDecay - Interactive Tree Visualization</h1>
+    <h2>Clade: $clade_id - $taxa_display</h2>
+    <div class="container">
+        <div class="tree-section">
+            <div class="buttons">
+                <button onclick="tree.spacing_x(100).spacing_y(20).update()">Expand Tree</button>
+                <button onclick="tree.spacing_x(30).spacing_y(10).update()">Compact Tree</button>
+                <button onclick="resetTree()">Reset View</button>
+                <button onclick="toggleLabels()">Toggle Labels</button>
+            </div>
+            <div id="tree_container"></div>
+            <div class="legend">
+                <div class="legend-item">
+                    <span class="legend-color" style="background-color: #e74c3c;"></span>
+                    <span>Highlighted Clade</span>
+                </div>
+                <div class="legend-item">
+                    <span class="legend-color" style="background-color: #999;"></span>
+                    <span>Other Nodes</span>
+                </div>
+            </div>
+        </div>
+        <div class="info-section">
+            <h3>Clade Information</h3>
+            <table class="table">
+                <tr><th>Number of Taxa:</th><td>$taxa_count</td></tr>
+                <tr><th>Taxa:</th><td>$taxa_sample</td></tr>$bootstrap_row
+            </table>$branch_support$site_analysis
+            <h3>Downloads</h3>
+            <div class="download-links">
+                <a href="$tree_file" download>Download Newick Tree</a>
+                <a href="#" onclick="saveSvg()">Download SVG</a>
+            </div>
+        </div>
+    </div>
+    <script>
+        // Taxa to highlight
+        const highlightTaxa = $highlight_taxa_json;
+        const highlightSet = new Set(highlightTaxa);
+        const highlightCache = new WeakMap(); // node -> isHighlighted result, reused across style passes
+
+        // Create tree
+        let tree = new phylotree.phylotree("$tree_file");
+        let showLabels = true;
+
+        // Initialize visualization on page load
+        document.addEventListener("DOMContentLoaded", function() {
+            loadAndDisplayTree();
+        });
+
+        function loadAndDisplayTree() {
+            fetch("$tree_file").then(response => {
+                if (response.ok) {
+                    return response.text();
+                }
+                throw new Error('Tree file not found');
+            })
+            .then(treeData => {
+                // Set up tree visualization
+                tree = new phylotree.phylotree(treeData);
+
+                // Configure tree display settings
+                tree.branch_length(null)  // Use branch lengths from the tree
+                    .branch_name(function(node) {
+                        return node.data.name;
+                    })
+                    .node_span(function(node) {
+                        return showLabels ? 5 : 2;
+                    })
+                    .node_circle_size(function(node) {
+                        return isHighlighted(node) ? 5 : 3;
+                    })
+                    .font_size(14)
+                    .scale_bar_font_size(12)
+                    .node_styler(nodeStyler)
+                    .branch_styler(branchStyler)
+                    .layout_handler(phylotree.layout_handlers.radial)
+                    .spacing_x(40) // Controls horizontal spacing
+                    .spacing_y(15) // Controls vertical spacing
+                    .size([550, 550])
+                    .radial(false); // Start with rectangular layout
+
+                // Get the container
+                let container = document.getElementById('tree_container');
+
+                // Render the tree
+                tree.render("#tree_container");
+            })
+            .catch(error => {
+                console.error("Error loading tree data:", error);
+                document.getElementById('tree_container').innerHTML =
+                    "<p style='color:red;padding:20px;'>Error loading tree data. Check console for details.</p>";
+            });
+        }
+
+        // Style branches that belong to the highlighted clade
+        function branchStyler(dom_element, link_data) {
+            if (isHighlighted(link_data.target)) {
+                dom_element.style.stroke = "#e74c3c";
+                dom_element.style.strokeWidth = "3px";
+                dom_element.classList.add("highlighted-branch");
+            }
+        }
+
+        // Style nodes that belong to the highlighted clade
+        function nodeStyler(dom_element, node_data) {
+            if (isHighlighted(node_data)) {
+                dom_element.classList.add("highlighted-node");
+            }
+        }
+
+        // Check if a node belongs to the highlighted clade
+        function isHighlighted(node) {
+            if (!node.data) return false;
+            if (highlightCache.has(node)) return highlightCache.get(node);
+
+            let result;
+            if (node.children && node.children.length === 0) {
+                // Directly check leaf nodes
+                result = highlightSet.has(node.data.name);
+            } else {
+                // For internal nodes, check if all descendants are in the highlighted taxa
+                let leaves = getAllLeaves(node);
+
+                // Check if this node represents exactly our clade
+                // or is contained within our clade
+                result = leaves.length > 0 && leaves.every(leaf => highlightSet.has(leaf.data.name));
+            }
+            highlightCache.set(node, result);
+            return result;
+        }
+
+        // Get all leaves (terminal nodes) descending from a node, appended to one shared array
+        function getAllLeaves(node, leaves = []) {
+            if (!node.children || node.children.length === 0) {
+                leaves.push(node);
+                return leaves;
+            }
+
+            for (let child of node.children) {
+                getAllLeaves(child, leaves);
+            }
+            return leaves;
+        }
+
+        // Reset tree to default view
+        function resetTree() {
+            tree.spacing_x(40)
+                .spacing_y(15)
+                .radial(false)
+                .update();
+        }
+
+        // Toggle display of leaf labels
+        function toggleLabels() {
+            showLabels = !showLabels;
+            tree.node_span(function(node) {
+                return showLabels ? 5 : 2;
+            }).update();
+        }
+
+        // Save tree as SVG
+        function saveSvg() {
+            let svg = document.querySelector("#tree_container svg");
+            let serializer = new XMLSerializer();
+            let source = serializer.serializeToString(svg);
+
+            // Add name spaces
+            if (!source.match(/^<svg[^>]+xmlns="http:\/\/www\.w3\.org\/2000\/svg"/)) {
+                source = source.replace(/^<svg/, '<svg xmlns="http://www.w3.org/2000/svg"');
+            }
+            if (!source.match(/^<svg[^>]+"http:\/\/www\.w3\.org\/1999\/xlink"/)) {
+                source = source.replace(/^<svg/, '<svg xmlns:xlink="http://www.w3.org/1999/xlink"');
+            }
+
+            // Add XML declaration
+            source = '<?xml version="1.0" standalone="no"?>\r\n' + source;
+
+            // Create download link
+            let downloadLink = document.createElement("a");
+            downloadLink.href = "data:image/svg+xml;charset=utf-8," + encodeURIComponent(source);
+            downloadLink.download = "tree_$clade_id.svg";
+            document.body.appendChild(downloadLink);
+            downloadLink.click();
+            document.body.removeChild(downloadLink);
+        }
+    </script>
+</body>
+</html>""")
+_HTML_JS_CDN = """    <script src="https://cdnjs.cloudflare.com/ajax/libs/d3/7.8.5/d3.min.js"></script>
+        <script src="https://cdn.jsdelivr.net/npm/phylotree@1.0.0-alpha.3/dist/phylotree.js"></script>"""
+_HTML_JS_EMBEDDED = """    <!-- Embedded D3 and Phylotree libraries would go here -->
+        <!-- This would make the file much larger -->"""
+
 
 class MLDecayIndices:
     """
@@ -44,7 +688,8 @@ class MLDecayIndices:
                  starting_tree: Path = None, data_type="dna",
                  debug=False, keep_files=False, gamma_shape=None, prop_invar=None,
                  base_freq=None, rates=None, protein_model=None, nst=None,
-                 parsmodel=None, paup_block=None):
+                 parsmodel=None, paup_block=None, jobs=1, persistent_paup=False,
+                 batch_constraints=False, bootstrap_fixed_pinvar=False):
 
         self.alignment_file = Path(alignment_file)
         self.alignment_format = alignment_format
@@ -61,6 +706,7 @@ class MLDecayIndices:
         self.nst_arg = nst
         self.parsmodel_arg = parsmodel # For discrete data, used in _convert_model_to_paup
         self.user_paup_block = paup_block # Raw user block content
+        self.bootstrap_fixed_pinvar = bootstrap_fixed_pinvar # Opt-in: estimate +I once on the ML tree, not per replicate
         self._files_to_cleanup = []
 
         self.data_type = data_type.lower()
@@ -69,7 +715,7 @@ class MLDecayIndices:
             self.data_type = "dna"
 
         if threads == "auto":
-            total_cores = multiprocessing.cpu_count()
+            total_cores = _available_cpus()
             if total_cores > 2:
                 self.threads = total_cores - 2 # Leave 2 cores for OS/other apps
             elif total_cores > 1:
@@ -78,7 +724,7 @@ class MLDecayIndices:
                 self.threads = 1 # Use 1 core if only 1 is available
             logger.info(f"Using 'auto' threads: PAUP* will be configured for {self.threads} thread(s) (leaving some for system).")
         elif str(threads).lower() == "all": # Add an explicit "all" option if you really want it
-            self.threads = multiprocessing.cpu_count()
+            self.threads = _available_cpus()
             logger.warning(f"PAUP* configured to use ALL {self.threads} threads. System may become unresponsive.")
         else:
             try:
@@ -86,15 +732,37 @@ class MLDecayIndices:
                 if self.threads < 1:
                     logger.warning(f"Thread count {self.threads} is invalid, defaulting to 1.")
                     self.threads = 1
-                elif self.threads > multiprocessing.cpu_count():
-                    logger.warning(f"Requested {self.threads} threads, but only {multiprocessing.cpu_count()} cores available. Using {multiprocessing.cpu_count()}.")
-                    self.threads = multiprocessing.cpu_count()
+                elif self.threads > _available_cpus():
+                    logger.warning(f"Requested {self.threads} threads, but only {_available_cpus()} cores available. Using {_available_cpus()}.")
+                    self.threads = _available_cpus()
             except ValueError:
                 logger.warning(f"Invalid thread count '{threads}', defaulting to 1.")
                 self.threads = 1
 
         logger.info(f"PAUP* will be configured to use up to {self.threads} thread(s).")
 
+        # Constraint searches may run as concurrent PAUP* processes sharing the thread budget
+        try:
+            self.jobs = max(1, int(jobs))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid job count '{jobs}', defaulting to 1.")
+            self.jobs = 1
+        self.threads_per_job = max(1, self.threads // self.jobs)
+        if self.jobs > 1:
+            logger.info(f"Constraint searches will run {self.jobs} at a time with {self.threads_per_job} PAUP* thread(s) each.")
+
+        # Persistent PAUP* sessions (one per worker thread) keep the alignment loaded between searches
+        self.persistent_paup = persistent_paup and paup_block is None
+        if persistent_paup and paup_block is not None:
+            logger.warning("Persistent PAUP* sessions are not used with a custom PAUP block; running one process per search.")
+        self._paup_sessions = []
+        self._paup_sessions_lock = threading.Lock()
+        # All constraint searches in one generated PAUP* script (one process, run sequentially)
+        self.batch_constraints = batch_constraints and paup_block is None
+        if batch_constraints and paup_block is not None:
+            logger.warning("Batched constraint searches are not used with a custom PAUP block; running one process per search.")
+        self._thread_local = threading.local()
+
         # --- Temporary Directory Setup ---
         self._temp_dir_obj = None  # For TemporaryDirectory lifecycle
         if self.debug or self.keep_files or temp_dir:
@@ -109,8 +777,10 @@ class MLDecayIndices:
                 self.temp_path = debug_runs_path / self.work_dir_name
                 self.temp_path.mkdir(parents=True, exist_ok=True)
             logger.info(f"Using temporary directory: {self.temp_path}")
-        else: # Auto-cleanup
-            self._temp_dir_obj = tempfile.TemporaryDirectory(prefix="mldecay_")
+        else: # Auto-cleanup; on tmpfs when available and TMPDIR does not name another location
+            use_shm = (not os.environ.get("TMPDIR") and SHM_DIR.is_dir() and os.access(SHM_DIR, os.W_OK)
+                       and shutil.disk_usage(SHM_DIR).free >= SHM_MIN_FREE_BYTES)
+            self._temp_dir_obj = tempfile.TemporaryDirectory(prefix="mldecay_", dir=str(SHM_DIR) if use_shm else None)
             self.temp_path = Path(self._temp_dir_obj.name)
             self.work_dir_name = self.temp_path.name
             logger.info(f"Using temporary directory (auto-cleanup): {self.temp_path}")
@@ -130,8 +800,13 @@ class MLDecayIndices:
 
         # --- Alignment Handling ---
         try:
-            self.alignment = AlignIO.read(str(self.alignment_file), self.alignment_format)
+            if self.alignment_format == "fasta": # Common case: skip Bio's per-record objects
+                self.alignment = FastaAlignment.from_file(self.alignment_file)
+            else:
+                self.alignment = AlignIO.read(str(self.alignment_file), self.alignment_format)
             logger.info(f"Loaded alignment: {len(self.alignment)} sequences, {self.alignment.get_alignment_length()} sites.")
+            self._all_taxa_ids = [rec.id for rec in self.alignment] # Walked once, not per constraint
+            self._num_taxa = len(self._all_taxa_ids)
         except Exception as e:
             logger.error(f"Failed to load alignment '{self.alignment_file}': {e}")
             if self._temp_dir_obj: self._temp_dir_obj.cleanup() # Manual cleanup if init fails early
@@ -141,18 +816,36 @@ class MLDecayIndices:
             if not self._validate_discrete_data():
                 logger.warning("Discrete data validation failed based on content, proceeding but results may be unreliable.")
 
-        if self.keep_files or self.debug: # Copy original alignment for debugging
-             shutil.copy(str(self.alignment_file), self.temp_path / f"original_alignment.{self.alignment_format}")
+        if self.keep_files or self.debug: # Link (or copy) original alignment for debugging
+            original_copy = self.temp_path / f"original_alignment.{self.alignment_format}"
+            if original_copy.is_symlink() or original_copy.exists(): original_copy.unlink() # Reused temp dir
+            try:
+                os.link(self.alignment_file, original_copy) # Hardlink, no data copied
+            except OSError:
+                try:
+                    os.symlink(self.alignment_file.resolve(), original_copy)
+                except OSError:
+                    shutil.copy(str(self.alignment_file), original_copy)
+
+        self._nexus_prelude, self._nexus_epilogue = self._build_nexus_sections(self.alignment.get_alignment_length())
 
         self.nexus_file_path = self.temp_path / NEXUS_ALIGNMENT_FN
         self._convert_to_nexus() # Writes to self.nexus_file_path
 
         self.ml_tree = None
         self.ml_likelihood = None
+        self.ml_clade_taxa = None # (names in tree order, taxon set) per ML tree internal node, from _parse_newick_clades
+        self.bootstrap_tree = None # Consensus tree with support values, set by run_bootstrap_analysis
         self.decay_indices = {}
 
+    @property
+    def has_bootstrap(self):
+        """True once a bootstrap consensus tree is available."""
+        return self.bootstrap_tree is not None
+
     def __del__(self):
         """Cleans up temporary files if TemporaryDirectory object was used."""
+        if hasattr(self, '_paup_sessions'): self.close_paup_sessions()
         if hasattr(self, '_temp_dir_obj') and self._temp_dir_obj:
             logger.debug(f"Attempting to cleanup temp_dir_obj for {self.temp_path}")
             self._temp_dir_obj.cleanup()
@@ -166,20 +859,21 @@ class MLDecayIndices:
     def _convert_model_to_paup(self, model_str, gamma_shape, prop_invar, base_freq, rates, protein_model, nst, parsmodel_user_intent):
         """Converts model string and params to PAUP* 'lset' command part (without 'lset' itself)."""
         cmd_parts = []
-        has_gamma = "+G" in model_str.upper()
-        has_invar = "+I" in model_str.upper()
-        base_model_name = model_str.split("+")[0].upper()
+        model_upper = model_str.upper()
+        has_gamma = "+G" in model_upper
+        has_invar = "+I" in model_upper
+        base_model_name = model_upper.split("+", 1)[0]
 
         if self.data_type == "dna":
-            if nst is not None: cmd_parts.append(f"nst={nst}")
-            elif base_model_name == "GTR": cmd_parts.append("nst=6")
-            elif base_model_name in ["HKY", "K2P", "K80", "TN93"]: cmd_parts.append("nst=2")
-            elif base_model_name in ["JC", "JC69", "F81"]: cmd_parts.append("nst=1")
+            if nst is not None: current_nst = str(nst)
+            elif base_model_name == "GTR": current_nst = "6"
+            elif base_model_name in ["HKY", "K2P", "K80", "TN93"]: current_nst = "2"
+            elif base_model_name in ["JC", "JC69", "F81"]: current_nst = "1"
             else:
                 logger.warning(f"Unknown DNA model: {base_model_name}, defaulting to GTR (nst=6).")
-                cmd_parts.append("nst=6")
+                current_nst = "6"
+            cmd_parts.append(f"nst={current_nst}")
 
-            current_nst = next((p.split('=')[1] for p in cmd_parts if "nst=" in p), None)
             if current_nst == '6' or (base_model_name == "GTR" and nst is None):
                 cmd_parts.append("rmatrix=estimate")
             elif current_nst == '2' or (base_model_name in ["HKY", "K2P"] and nst is None):
@@ -190,9 +884,8 @@ class MLDecayIndices:
             else: cmd_parts.append("basefreq=estimate") # GTR, HKY, F81, TN93 default to estimate
 
         elif self.data_type == "protein":
-            valid_protein_models = ["JTT", "WAG", "LG", "DAYHOFF", "MTREV", "CPREV", "BLOSUM62", "HIVB", "HIVW"]
             if protein_model: cmd_parts.append(f"protein={protein_model.lower()}")
-            elif base_model_name.upper() in valid_protein_models: cmd_parts.append(f"protein={base_model_name.lower()}")
+            elif base_model_name in _PROTEIN_MODELS: cmd_parts.append(f"protein={base_model_name.lower()}")
             else:
                 logger.warning(f"Unknown protein model: {base_model_name}, defaulting to JTT.")
                 cmd_parts.append("protein=jtt")
@@ -209,11 +902,11 @@ class MLDecayIndices:
 
 
         # Common rate variation and invariable sites for all data types
-        if rates: cmd_parts.append(f"rates={rates}")
-        elif has_gamma: cmd_parts.append("rates=gamma")
-        else: cmd_parts.append("rates=equal")
+        if rates: current_rates = rates
+        elif has_gamma: current_rates = "gamma"
+        else: current_rates = "equal"
+        cmd_parts.append(f"rates={current_rates}")
 
-        current_rates = next((p.split('=')[1] for p in cmd_parts if "rates=" in p), "equal")
         if gamma_shape is not None and (current_rates == "gamma" or has_gamma):
             cmd_parts.append(f"shape={gamma_shape}")
         elif current_rates == "gamma" or has_gamma:
@@ -231,61 +924,78 @@ class MLDecayIndices:
     def _validate_discrete_data(self):
         """Validate that discrete data contains only 0, 1, -, ? characters."""
         if self.data_type == "discrete":
-            valid_chars = set("01-?")
-            for record in self.alignment:
-                seq_chars = set(str(record.seq).upper()) # Convert to upper for case-insensitivity if needed
-                invalid_chars = seq_chars - valid_chars
-                if invalid_chars:
-                    logger.warning(f"Sequence {record.id} contains invalid discrete characters: {invalid_chars}. Expected only 0, 1, -, ?.")
-                    return False
+            valid_bytes = np.frombuffer(b"01-?", dtype=np.uint8) # Case-insensitive by construction
+            matrix = self._alignment_matrix()
+            invalid = ~np.isin(matrix, valid_bytes)
+            bad_rows = np.flatnonzero(invalid.any(axis=1))
+            if bad_rows.size:
+                row = bad_rows[0]
+                invalid_chars = set(np.unique(matrix[row][invalid[row]]).tobytes().decode('latin-1'))
+                taxon_id = self._all_taxa_ids[row]
+                logger.warning(f"Sequence {taxon_id} contains invalid discrete characters: {invalid_chars}. Expected only 0, 1, -, ?.")
+                return False
         return True
 
     def _format_taxon_for_paup(self, taxon_name):
         """Format a taxon name for PAUP* (handles spaces, special chars by quoting)."""
         if not isinstance(taxon_name, str): taxon_name = str(taxon_name)
-        # PAUP* needs quotes if name contains whitespace or NEXUS special chars: ( ) [ ] { } / \ , ; = * ` " ' < >
-        if re.search(r'[\s\(\)\[\]\{\}/\\,;=\*`"\'<>]', taxon_name) or ':' in taxon_name: # Colon also problematic
-            return f"'{taxon_name.replace(chr(39), '_')}'" # chr(39) is single quote
+        if taxon_name.isidentifier(): return taxon_name # Letters/digits/underscores only: never needs quoting
+        # PAUP* needs quotes if name contains whitespace or NEXUS special chars: ( ) [ ] { } / \ , ; = * ` " ' < > :
+        if _TAXON_BAD_RE.search(taxon_name):
+            return "'" + taxon_name.replace("'", "_") + "'"
 
         return taxon_name
 
+    @functools.cached_property
+    def _formatted_taxa(self):
+        """PAUP*-formatted name of every alignment taxon, so constraint specs need no per-clade formatting."""
+        return {taxon: self._format_taxon_for_paup(taxon) for taxon in self._all_taxa_ids}
+
+    def _alignment_matrix(self):
+        """Returns the alignment as an (ntax, nchar) uint8 array."""
+        if isinstance(self.alignment, FastaAlignment):
+            return self.alignment.seqs
+        return np.array([np.frombuffer(str(record.seq).encode('latin-1'), dtype=np.uint8) for record in self.alignment])
+
+    def _build_nexus_sections(self, nchar):
+        """Returns the static (prelude, epilogue) text around the NEXUS MATRIX rows."""
+        dt = {"protein": "PROTEIN", "discrete": "STANDARD"}.get(self.data_type, "DNA")
+        symbols = ' SYMBOLS="01"' if self.data_type == "discrete" else "" # Assuming binary discrete data
+        prelude = (
+            "#NEXUS\n\nBEGIN DATA;\n"
+            f"  DIMENSIONS NTAX={len(self.alignment)} NCHAR={nchar};\n"
+            f"  FORMAT DATATYPE={dt} MISSING=? GAP=- INTERLEAVE=NO{symbols};\n"
+            "  MATRIX\n"
+        )
+        epilogue = "  ;\nEND;\n"
+        if self.data_type == "discrete":
+            epilogue += "\nBEGIN ASSUMPTIONS;\n"
+            epilogue += "  OPTIONS DEFTYPE=UNORD POLYTCOUNT=MINSTEPS;\n" # Common for Mk
+            epilogue += "END;\n"
+        return prelude, epilogue
+
     def _convert_to_nexus(self):
         """Converts alignment to NEXUS, writes to self.nexus_file_path."""
+        taxon_ids = [record.id for record in self.alignment]
+        rows = (str(record.seq) for record in self.alignment)
         try:
-            with open(self.nexus_file_path, 'w') as f:
-                f.write("#NEXUS\n\n")
-                f.write("BEGIN DATA;\n")
-                dt = "DNA"
-                if self.data_type == "protein": dt = "PROTEIN"
-                elif self.data_type == "discrete": dt = "STANDARD"
-
-                f.write(f"  DIMENSIONS NTAX={len(self.alignment)} NCHAR={self.alignment.get_alignment_length()};\n")
-                format_line = f"  FORMAT DATATYPE={dt} MISSING=? GAP=- INTERLEAVE=NO"
-                if self.data_type == "discrete":
-                    format_line += " SYMBOLS=\"01\"" # Assuming binary discrete data
-                f.write(format_line + ";\n")
-                f.write("  MATRIX\n")
-                for record in self.alignment:
-                    f.write(f"  {self._format_taxon_for_paup(record.id)} {record.seq}\n")
-                f.write("  ;\nEND;\n")
-
-                if self.data_type == "discrete":
-                    f.write("\nBEGIN ASSUMPTIONS;\n")
-                    f.write("  OPTIONS DEFTYPE=UNORD POLYTCOUNT=MINSTEPS;\n") # Common for Mk
-                    f.write("END;\n")
+            with open(self.nexus_file_path, 'w', buffering=1 << 20) as f:
+                f.write(self._nexus_prelude)
+                f.write("".join([f"  {self._format_taxon_for_paup(taxon)} {row}\n" for taxon, row in zip(taxon_ids, rows)]))
+                f.write(self._nexus_epilogue)
             logger.info(f"Converted alignment to NEXUS: {self.nexus_file_path}")
         except Exception as e:
             logger.error(f"Failed to convert alignment to NEXUS: {e}")
             raise
 
-    def _get_paup_model_setup_cmds(self):
-        """Returns the model setup command string(s) for PAUP* script."""
+    def _build_model_setup_cmds(self, nthreads):
+        """Returns the model setup command string(s) for a PAUP* script using nthreads."""
         if self.user_paup_block is None:
             # self.paup_model_cmds is like "lset nst=6 ...;"
             # Remove "lset " for combining with nthreads, keep ";"
             model_params_only = self.paup_model_cmds.replace("lset ", "", 1)
             base_cmds = [
-                f"lset nthreads={self.threads} {model_params_only}", # model_params_only includes the trailing ";"
+                f"lset nthreads={nthreads} {model_params_only}", # model_params_only includes the trailing ";"
                 "set criterion=likelihood;"
             ]
             if self.data_type == "discrete":
@@ -298,6 +1008,90 @@ class MLDecayIndices:
             # Assume it sets threads, model, criterion, etc.
             return self.paup_model_cmds # Return as is, for direct insertion
 
+    @functools.cached_property
+    def _paup_model_setup_cmds(self):
+        """Model setup command string(s) for PAUP* scripts (fixed once the model is converted)."""
+        return self._build_model_setup_cmds(self.threads)
+
+    @functools.cached_property
+    def _job_model_setup_cmds(self):
+        """Model setup for constraint searches, which may run self.jobs at a time."""
+        return self._build_model_setup_cmds(self.threads_per_job)
+
+    @functools.cached_property
+    def _script_prefix(self):
+        """Invariant head of every PAUP* script: load the alignment and set up the model."""
+        return f"#NEXUS\nbegin paup;\nexecute {NEXUS_ALIGNMENT_FN};\n{self._paup_model_setup_cmds}\n"
+
+    @functools.cached_property
+    def _job_script_prefix(self):
+        """Script head for constraint searches, using the per-job thread count."""
+        return f"#NEXUS\nbegin paup;\nexecute {NEXUS_ALIGNMENT_FN};\n{self._job_model_setup_cmds}\n"
+
+    @functools.cached_property
+    def _bootstrap_model_cmds(self):
+        """
+        Commands run before the bootstrap: with bootstrap_fixed_pinvar and an estimated pinvar, it is
+        estimated once on the ML tree and held at that value for every replicate.
+        """
+        if not self.bootstrap_fixed_pinvar or self.user_paup_block is not None or "pinvar=estimate" not in self.paup_model_cmds:
+            return []
+        logger.info("Bootstrap replicates will use the proportion of invariable sites estimated on the ML tree.")
+        return [f"gettrees file={ML_TREE_FN} mode=3;", "lscores 1;", "lset pinvar=previous;"]
+
+    def _get_paup_session(self):
+        """Returns this thread's persistent PAUP* session, starting it on first use, or None if disabled."""
+        if not self.persistent_paup:
+            return None
+        session = getattr(self._thread_local, 'session', None)
+        if session is not None and session.alive:
+            return session
+        setup_log_fn = f"paup_session_{threading.get_ident()}.log"
+        try:
+            session = PaupSession(self.paup_path, self.temp_path,
+                                  f"execute {NEXUS_ALIGNMENT_FN};\n{self._job_model_setup_cmds}",
+                                  self.temp_path / setup_log_fn, timeout_sec=600)
+        except Exception as e:
+            logger.warning(f"Could not start a persistent PAUP* session ({e}); falling back to one process per search.")
+            self.persistent_paup = False
+            return None
+        self._thread_local.session = session
+        with self._paup_sessions_lock:
+            self._paup_sessions.append(session)
+        return session
+
+    def close_paup_sessions(self):
+        """Shuts down any persistent PAUP* sessions."""
+        with self._paup_sessions_lock:
+            sessions, self._paup_sessions = self._paup_sessions, []
+        for session in sessions:
+            session.close()
+
+    @staticmethod
+    def _write_paup_script(cmd_file_path: Path, prefix: str, script_cmds):
+        """Writes prefix, script_cmds and the closing quit/end to cmd_file_path without concatenating them first."""
+        with cmd_file_path.open('w', buffering=1 << 16) as fh:
+            fh.write(prefix)
+            fh.write("\n".join(script_cmds))
+            fh.write("\nquit;\nend;\n")
+
+    def _run_paup_commands(self, script_cmds, paup_cmd_filename_str: str, log_filename_str: str,
+                           timeout_sec: int = None, session_setup: str = None):
+        """
+        Runs script_cmds in this thread's persistent PAUP* session when one is active, otherwise
+        runs the already written command file in a fresh PAUP* process.
+
+        session_setup is sent ahead of script_cmds in a session, e.g. to restore the full thread count.
+        """
+        session = self._get_paup_session()
+        if session is None:
+            self._run_paup_command_file(paup_cmd_filename_str, log_filename_str, timeout_sec=timeout_sec)
+            return
+        commands = "\n".join(script_cmds)
+        if session_setup: commands = f"{session_setup}\n{commands}"
+        logger.info(f"Running {paup_cmd_filename_str} in persistent PAUP* session (Log: {log_filename_str})")
+        session.run(commands, self.temp_path / log_filename_str, timeout_sec=timeout_sec)
+
     def _run_paup_command_file(self, paup_cmd_filename_str: str, log_filename_str: str, timeout_sec: int = None):
         """Runs a PAUP* .nex command file located in self.temp_path."""
         paup_cmd_file = self.temp_path / paup_cmd_filename_str
@@ -310,54 +1104,38 @@ class MLDecayIndices:
 
         logger.info(f"Running PAUP* command file: {paup_cmd_filename_str} (Log: {log_filename_str})")
 
-        # stdout_content and stderr_content will be filled for logging/debugging if needed
-        stdout_capture = ""
-        stderr_capture = ""
-
         try:
-            # Open the log file once for both stdout and stderr
-            with open(combined_log_file_path, 'w') as f_log:
+            # PAUP* writes stdout and stderr straight into the log file; only a bounded
+            # tail is read back afterwards, so large logs are never held in memory.
+            with open(combined_log_file_path, 'wb', buffering=1 << 16) as f_log:
                 process = subprocess.Popen(
                     [self.paup_path, "-n", paup_cmd_filename_str],
                     cwd=str(self.temp_path),
-                    stdout=subprocess.PIPE, # Capture stdout
-                    stderr=subprocess.PIPE, # Capture stderr
-                    text=True,
-                    universal_newlines=True # For text=True
+                    stdout=f_log,
+                    stderr=subprocess.STDOUT
                 )
 
-                # Read stdout and stderr in a non-blocking way or use communicate
-                # communicate() is simpler and safer for handling potential deadlocks
                 try:
-                    stdout_capture, stderr_capture = process.communicate(timeout=timeout_sec)
+                    retcode = process.wait(timeout=timeout_sec)
                 except subprocess.TimeoutExpired:
                     process.kill() # Ensure process is killed on timeout
-                    stdout_capture, stderr_capture = process.communicate() # Try to get any remaining output
+                    process.wait()
                     logger.error(f"PAUP* command {paup_cmd_filename_str} timed out after {timeout_sec}s.")
-                    f_log.write(f"--- PAUP* Execution Timed Out ({timeout_sec}s) ---\n")
-                    if stdout_capture: f_log.write("--- STDOUT (partial) ---\n" + stdout_capture)
-                    if stderr_capture: f_log.write("\n--- STDERR (partial) ---\n" + stderr_capture)
+                    f_log.write(f"\n--- PAUP* Execution Timed Out ({timeout_sec}s) ---\n".encode())
                     raise # Re-raise the TimeoutExpired exception
 
-                # Write captured output to the log file
-                f_log.write("--- STDOUT ---\n")
-                f_log.write(stdout_capture if stdout_capture else "No stdout captured.\n")
-                if stderr_capture:
-                    f_log.write("\n--- STDERR ---\n")
-                    f_log.write(stderr_capture)
-
-                retcode = process.returncode
-                if retcode != 0:
-                    logger.error(f"PAUP* execution failed for {paup_cmd_filename_str}. Exit code: {retcode}")
-                    # The log file already contains stdout/stderr
-                    logger.error(f"PAUP* stdout/stderr saved to {combined_log_file_path}. Stderr sample: {stderr_capture[:500]}...")
-                    # Raise an equivalent of CalledProcessError
-                    raise subprocess.CalledProcessError(retcode, process.args, output=stdout_capture, stderr=stderr_capture)
+            output_tail = self._read_log_tail(combined_log_file_path)
+
+            if retcode != 0:
+                logger.error(f"PAUP* execution failed for {paup_cmd_filename_str}. Exit code: {retcode}")
+                # The log file already contains stdout/stderr
+                logger.error(f"PAUP* stdout/stderr saved to {combined_log_file_path}. Output tail: ...{output_tail[-500:]}")
+                # Raise an equivalent of CalledProcessError
+                raise subprocess.CalledProcessError(retcode, process.args, output=output_tail)
 
             if self.debug:
                 logger.debug(f"PAUP* output saved to: {combined_log_file_path}")
-                logger.debug(f"PAUP* stdout sample (from capture):\n{stdout_capture[:500]}...")
-                if stderr_capture: logger.debug(f"PAUP* stderr sample (from capture):\n{stderr_capture[:500]}...")
+                logger.debug(f"PAUP* output sample (log tail):\n...{output_tail[-500:]}")
 
             # Return a simple object that mimics CompletedProcess for the parts we use
             # Or adjust callers to expect (stdout_str, stderr_str, retcode) tuple
@@ -368,51 +1146,67 @@ class MLDecayIndices:
                     self.stdout = stdout
                     self.stderr = stderr
 
-            return MockCompletedProcess(process.args, retcode, stdout_capture, stderr_capture)
+            # stderr is merged into the log, so stdout carries the combined tail
+            return MockCompletedProcess(process.args, retcode, output_tail, "")
 
         except subprocess.CalledProcessError: # Already logged, just re-raise
             raise
         except subprocess.TimeoutExpired: # Already logged, just re-raise
             raise
         except Exception as e:
-            # Fallback for other errors during Popen or communicate
+            # Fallback for other errors during Popen or wait
             logger.error(f"Unexpected error running PAUP* for {paup_cmd_filename_str}: {e}")
             # Attempt to write to log if f_log was opened
             if 'f_log' in locals() and not f_log.closed:
-                 f_log.write(f"\n--- Script Error during PAUP* execution ---\n{str(e)}\n")
+                 f_log.write(f"\n--- Script Error during PAUP* execution ---\n{str(e)}\n".encode())
             raise
 
+    @staticmethod
+    def _read_log_tail(log_path: Path, max_bytes: int = 65536):
+        """Returns (up to) the last max_bytes of a log file as text."""
+        with open(log_path, 'rb') as fh:
+            size = fh.seek(0, os.SEEK_END)
+            fh.seek(max(0, size - max_bytes))
+            return fh.read().decode(errors='replace')
+
+    @staticmethod
+    def _likelihood_from_log(log_path: Path):
+        """Returns the last likelihood reported in a PAUP* log, or None. The log is scanned undecoded."""
+        matches = _LOG_LNL_RE.findall(log_path.read_bytes())
+        return float(matches[-1]) if matches else None # float() accepts the ASCII digits as bytes
+
     def _parse_likelihood_from_score_file(self, score_file_path: Path):
         if not score_file_path.exists():
             logger.warning(f"Score file not found: {score_file_path}")
             return None
         try:
-            content = score_file_path.read_text()
-            if self.debug: logger.debug(f"Score file ({score_file_path}) content:\n{content}")
-
-            lines = content.splitlines()
-            header_idx, lnl_col_idx = -1, -1
-
-            for i, line_text in enumerate(lines):
-                norm_line = ' '.join(line_text.strip().lower().split()) # Normalize
-                if "tree" in norm_line and ("-lnl" in norm_line or "loglk" in norm_line or "likelihood" in norm_line):
-                    header_idx = i
-                    headers = norm_line.split()
-                    for col_name in ["-lnl", "loglk", "likelihood", "-loglk"]:
+            def find_header(text):
+                # The most recent lscores block is the last matching header
+                for m in reversed(list(_LNL_HEADER_RE.finditer(text))):
+                    headers = m.group(0).lower().split()
+                    for col_name in _LNL_COLUMN_NAMES:
                         if col_name in headers:
-                            lnl_col_idx = headers.index(col_name)
-                            break
-                    if lnl_col_idx != -1: break
+                            return m, headers.index(col_name)
+                return None, -1
+
+            # Scores of the latest lscores call sit at the end of the file, so read only the tail
+            tail_bytes = 16384
+            content = self._read_log_tail(score_file_path, max_bytes=tail_bytes)
+            truncated = score_file_path.stat().st_size > tail_bytes
+            if truncated: content = content.split("\n", 1)[-1] # Drop the partial first line
+            header_match, lnl_col_idx = find_header(content)
+            if header_match is None and truncated: # Header is further back: fall back to the whole file
+                content = score_file_path.read_text()
+                header_match, lnl_col_idx = find_header(content)
+            if self.debug: logger.debug(f"Score file ({score_file_path}) content:\n{content}")
 
-            if header_idx == -1 or lnl_col_idx == -1:
+            if header_match is None:
                 logger.warning(f"Could not find valid header or likelihood column in {score_file_path}.")
                 return None
-            logger.debug(f"Found LNL column at index {lnl_col_idx} in header: {lines[header_idx].strip()}")
-
-            for i in range(header_idx + 1, len(lines)):
-                data_line_text = lines[i].strip()
-                if not data_line_text: continue # Skip empty
+            logger.debug(f"Found LNL column at index {lnl_col_idx} in header: {header_match.group(0).strip()}")
 
+            for row_match in _LNL_ROW_RE.finditer(content, header_match.end()):
+                data_line_text = row_match.group(0).strip()
                 parts = data_line_text.split()
                 if len(parts) > lnl_col_idx:
                     try:
@@ -434,7 +1228,7 @@ class MLDecayIndices:
 
     def build_ml_tree(self):
         logger.info("Building maximum likelihood tree...")
-        script_cmds = [f"execute {NEXUS_ALIGNMENT_FN};", self._get_paup_model_setup_cmds()]
+        script_cmds = [] # Commands after the shared _script_prefix
 
         if self.user_paup_block is None: # Standard model processing, add search commands
             if self.starting_tree and self.starting_tree.exists():
@@ -461,21 +1255,21 @@ class MLDecayIndices:
             if "lscores" not in block_lower and "lscore" not in block_lower : # Check for lscore too
                 script_cmds.append(f"lscores 1 / scorefile={ML_SCORE_FN} replace=yes;")
 
-        paup_script_content = f"#NEXUS\nbegin paup;\n" + "\n".join(script_cmds) + "\nquit;\nend;\n"
         ml_search_cmd_path = self.temp_path / ML_SEARCH_NEX_FN
-        ml_search_cmd_path.write_text(paup_script_content)
-        if self.debug: logger.debug(f"ML search PAUP* script ({ml_search_cmd_path}):\n{paup_script_content}")
+        self._write_paup_script(ml_search_cmd_path, self._script_prefix, script_cmds)
+        if self.debug: logger.debug(f"ML search PAUP* script ({ml_search_cmd_path}):\n{ml_search_cmd_path.read_text()}")
 
         try:
-            paup_result = self._run_paup_command_file(ML_SEARCH_NEX_FN, ML_LOG_FN, timeout_sec=3600) # 1hr timeout
+            if self.user_paup_block is None:
+                self._run_paup_commands(script_cmds, ML_SEARCH_NEX_FN, ML_LOG_FN, timeout_sec=3600, # 1hr timeout
+                                        session_setup=self._paup_model_setup_cmds) # Sessions start with per-job threads
+            else: # The user block may search on its own; a session would run it again as setup
+                self._run_paup_command_file(ML_SEARCH_NEX_FN, ML_LOG_FN, timeout_sec=3600)
 
             self.ml_likelihood = self._parse_likelihood_from_score_file(self.temp_path / ML_SCORE_FN)
-            if self.ml_likelihood is None and paup_result.stdout: # Fallback to log
+            if self.ml_likelihood is None: # Fallback to log
                 logger.info(f"Fallback: Parsing ML likelihood from PAUP* log {ML_LOG_FN}")
-                patterns = [r'-ln\s*L\s*=\s*([0-9.]+)', r'likelihood\s*=\s*([0-9.]+)', r'score\s*=\s*([0-9.]+)']
-                for p in patterns:
-                    m = re.findall(p, paup_result.stdout, re.IGNORECASE)
-                    if m: self.ml_likelihood = float(m[-1]); break
+                self.ml_likelihood = self._likelihood_from_log(self.temp_path / ML_LOG_FN)
                 if self.ml_likelihood: logger.info(f"Extracted ML likelihood from log: {self.ml_likelihood}")
                 else: logger.warning("Could not extract ML likelihood from PAUP* log.")
 
@@ -484,6 +1278,7 @@ class MLDecayIndices:
                 # Clean the tree file if it has metadata after semicolon
                 cleaned_tree_path = self._clean_newick_tree(ml_tree_path)
                 self.ml_tree = Phylo.read(str(cleaned_tree_path), "newick")
+                self.ml_clade_taxa = self._parse_newick_clades(cleaned_tree_path)
                 logger.info(f"Successfully built ML tree. Log-likelihood: {self.ml_likelihood if self.ml_likelihood is not None else 'N/A'}")
                 if self.ml_likelihood is None:
                     logger.error("ML tree built, but likelihood could not be determined. Analysis may be compromised.")
@@ -495,6 +1290,70 @@ class MLDecayIndices:
             logger.error(f"ML tree construction failed: {e}")
             raise # Re-raise to be handled by the main try-except block
 
+    @staticmethod
+    def _parse_newick_clades(tree_path):
+        """
+        Return (taxon names in tree order, frozenset of those names) for each internal node
+        of a Newick tree, in preorder.
+
+        A lightweight alternative to walking Bio.Phylo clades when only topology is needed;
+        the order matches Bio.Phylo's get_nonterminals() for the same tree.
+        """
+        text = Path(tree_path).read_text()
+        n = len(text)
+        clades = [] # Slot reserved at each '(' and filled at the matching ')'
+        open_nodes = [] # (slot index, offset into leaves) for each unclosed '('
+        leaves = []
+        after_close = False # A label right after ')' is an internal node label, not a taxon
+        i = 0
+        while i < n:
+            ch = text[i]
+            if ch == '(':
+                open_nodes.append((len(clades), len(leaves)))
+                clades.append(None)
+                after_close = False
+                i += 1
+            elif ch == ')':
+                if not open_nodes: raise ValueError(f"Unbalanced parentheses in Newick tree {tree_path}")
+                slot, start = open_nodes.pop()
+                names = tuple(leaves[start:])
+                clades[slot] = (names, frozenset(names))
+                after_close = True
+                i += 1
+            elif ch == ',':
+                after_close = False
+                i += 1
+            elif ch == ';':
+                break
+            elif ch == '[': # Comment
+                end = text.find(']', i)
+                i = n if end == -1 else end + 1
+            elif ch == ':': # Branch length
+                i += 1
+                while i < n and text[i] not in ',();[': i += 1
+            elif ch.isspace():
+                i += 1
+            else:
+                if ch == "'": # Quoted label; '' is an escaped quote
+                    chars = []
+                    i += 1
+                    while i < n:
+                        if text[i] == "'":
+                            if i + 1 < n and text[i + 1] == "'":
+                                chars.append("'"); i += 2; continue
+                            i += 1
+                            break
+                        chars.append(text[i]); i += 1
+                    label = "".join(chars)
+                else:
+                    start = i
+                    while i < n and text[i] not in "(),:;[" and not text[i].isspace(): i += 1
+                    label = text[start:i]
+                if not after_close and open_nodes:
+                    leaves.append(label)
+        if open_nodes: raise ValueError(f"Unbalanced parentheses in Newick tree {tree_path}")
+        return clades
+
     def _clean_newick_tree(self, tree_path, delete_cleaned=True):
         """
         Clean Newick tree files that may have metadata after the semicolon.
@@ -507,34 +1366,35 @@ class MLDecayIndices:
             Path to a cleaned tree file or the original path if no cleaning was needed
         """
         try:
-            content = Path(tree_path).read_text()
-
-            # Check if there's any text after a semicolon (including whitespace)
-            semicolon_match = re.search(r';(.+)', content, re.DOTALL)
-            if semicolon_match:
-                # Get everything up to the first semicolon
-                clean_content = content.split(';')[0] + ';'
-
-                # Write the cleaned tree to a new file
-                cleaned_path = Path(str(tree_path) + '.cleaned')
-                cleaned_path.write_text(clean_content)
-
-                # Mark the file for later deletion if requested
-                if delete_cleaned:
-                    self._files_to_cleanup.append(cleaned_path)
-
-                if self.debug:
-                    logger.debug(f"Original tree content: '{content}'")
-                    logger.debug(f"Cleaned tree content: '{clean_content}'")
+            if Path(tree_path).stat().st_size == 0:
+                return tree_path # Nothing to clean (and an empty file cannot be mapped)
+
+            # Scan the mapped bytes for the first semicolon instead of loading the whole file.
+            # A file ending in ';' is not a safe shortcut: savetrees may write several tied trees.
+            with open(tree_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                semicolon_pos = mm.find(b';')
+                if semicolon_pos == -1 or not mm[semicolon_pos + 1:].strip():
+                    return tree_path # No semicolon, or only whitespace after it
+                clean_content = mm[:semicolon_pos + 1].decode('utf-8')
+                if self.debug: content = mm[:].decode('utf-8', errors='replace')
+
+            # Text after the first semicolon: write only the first tree to a new file
+            cleaned_path = Path(str(tree_path) + '.cleaned')
+            cleaned_path.write_text(clean_content)
+
+            # Mark the file for later deletion if requested
+            if delete_cleaned:
+                self._files_to_cleanup.append(cleaned_path)
 
-                logger.info(f"Cleaned tree file {tree_path} - removed metadata after semicolon")
-                return cleaned_path
+            if self.debug:
+                logger.debug(f"Original tree content: '{content}'")
+                logger.debug(f"Cleaned tree content: '{clean_content}'")
 
-            return tree_path  # No cleaning needed
+            logger.info(f"Cleaned tree file {tree_path} - removed metadata after semicolon")
+            return cleaned_path
         except Exception as e:
             logger.warning(f"Error cleaning Newick tree {tree_path}: {e}")
             if self.debug:
-                import traceback
                 logger.debug(f"Traceback for tree cleaning error: {traceback.format_exc()}")
             return tree_path  # Return original path if cleaning fails
 
@@ -555,7 +1415,7 @@ class MLDecayIndices:
 
         logger.info(f"Running bootstrap analysis with {num_replicates} replicates...")
 
-        script_cmds = [f"execute {NEXUS_ALIGNMENT_FN};", self._get_paup_model_setup_cmds()]
+        script_cmds = list(self._bootstrap_model_cmds) # Commands after the shared _script_prefix
 
         # Add bootstrap commands
         script_cmds.extend([
@@ -564,16 +1424,19 @@ class MLDecayIndices:
         ])
 
         # Create and execute PAUP script
-        paup_script_content = f"#NEXUS\nbegin paup;\n" + "\n".join(script_cmds) + "\nquit;\nend;\n"
         bootstrap_cmd_path = self.temp_path / BOOTSTRAP_NEX_FN
-        bootstrap_cmd_path.write_text(paup_script_content)
+        self._write_paup_script(bootstrap_cmd_path, self._script_prefix, script_cmds)
 
-        if self.debug: logger.debug(f"Bootstrap PAUP* script ({bootstrap_cmd_path}):\n{paup_script_content}")
+        if self.debug: logger.debug(f"Bootstrap PAUP* script ({bootstrap_cmd_path}):\n{bootstrap_cmd_path.read_text()}")
 
         try:
             # Run the bootstrap analysis - timeout based on number of replicates
-            self._run_paup_command_file(BOOTSTRAP_NEX_FN, BOOTSTRAP_LOG_FN,
-                                      timeout_sec=max(3600, 60 * num_replicates))
+            timeout_sec = max(3600, 60 * num_replicates)
+            if self.user_paup_block is None:
+                self._run_paup_commands(script_cmds, BOOTSTRAP_NEX_FN, BOOTSTRAP_LOG_FN, timeout_sec=timeout_sec,
+                                        session_setup=self._paup_model_setup_cmds)
+            else:
+                self._run_paup_command_file(BOOTSTRAP_NEX_FN, BOOTSTRAP_LOG_FN, timeout_sec=timeout_sec)
 
             # Get the bootstrap tree
             bootstrap_tree_path = self.temp_path / BOOTSTRAP_TREE_FN
@@ -597,12 +1460,9 @@ class MLDecayIndices:
                     bootstrap_tree = Phylo.read(str(cleaned_tree_path), "newick")
                     self.bootstrap_tree = bootstrap_tree
 
-                    # Verify that bootstrap values are present
-                    has_bootstrap_values = False
-                    for node in bootstrap_tree.get_nonterminals():
-                        if node.confidence is not None:
-                            has_bootstrap_values = True
-                            break
+                    # Verify that bootstrap values are present (lazy walk, stops at the first labelled node)
+                    has_bootstrap_values = any(node.confidence is not None
+                                               for node in bootstrap_tree.find_clades(terminal=False))
 
                     if has_bootstrap_values:
                         logger.info(f"Bootstrap analysis complete with {num_replicates} replicates and bootstrap values")
@@ -613,7 +1473,6 @@ class MLDecayIndices:
                 except Exception as parse_error:
                     logger.error(f"Error parsing bootstrap tree: {parse_error}")
                     if self.debug:
-                        import traceback
                         logger.debug(f"Traceback for bootstrap parse error: {traceback.format_exc()}")
                     return None
             else:
@@ -622,11 +1481,16 @@ class MLDecayIndices:
         except Exception as e:
             logger.error(f"Bootstrap analysis failed: {e}")
             if self.debug:
-                import traceback
                 logger.debug(f"Traceback: {traceback.format_exc()}")
             return None
 
-    def run_au_test(self, tree_filenames_relative: list):
+    def run_au_test(self, tree_filenames_relative: list, site_likelihoods=False):
+        """
+        Scores all trees in one PAUP* run with the AU test and returns the parsed results.
+
+        With site_likelihoods=True the same lscores call also writes per-site likelihoods
+        for every tree to AU_TEST_SCORE_FN, so site analysis needs no extra PAUP* runs.
+        """
         if not tree_filenames_relative:
             logger.error("No tree files for AU test.")
             return None
@@ -638,59 +1502,102 @@ class MLDecayIndices:
                 return {1: {'lnL': self.ml_likelihood, 'AU_pvalue': 1.0}} # Best tree p-val = 1
             return None
 
-        script_cmds = [f"execute {NEXUS_ALIGNMENT_FN};", self._get_paup_model_setup_cmds()]
+        script_cmds = [] # Commands after the shared _script_prefix
         script_cmds.append(f"gettrees file={tree_filenames_relative[0]} mode=3 storebrlens=yes;")
         for rel_fn in tree_filenames_relative[1:]:
             script_cmds.append(f"gettrees file={rel_fn} mode=7 storebrlens=yes;")
 
         # AU_TEST_SCORE_FN is the file PAUP* writes scores to. We parse from AU_LOG_FN.
-        script_cmds.append(f"lscores 1-{num_trees} / autest=yes scorefile={AU_TEST_SCORE_FN} replace=yes;")
+        sitelikes_opt = " sitelikes=yes" if site_likelihoods else ""
+        script_cmds.append(f"lscores 1-{num_trees} / autest=yes{sitelikes_opt} scorefile={AU_TEST_SCORE_FN} replace=yes;")
 
-        paup_script_content = f"#NEXUS\nbegin paup;\n" + "\n".join(script_cmds) + "\nquit;\nend;\n"
         au_cmd_path = self.temp_path / AU_TEST_NEX_FN
-        au_cmd_path.write_text(paup_script_content)
-        if self.debug: logger.debug(f"AU test PAUP* script ({au_cmd_path}):\n{paup_script_content}")
+        self._write_paup_script(au_cmd_path, self._script_prefix, script_cmds)
+        if self.debug: logger.debug(f"AU test PAUP* script ({au_cmd_path}):\n{au_cmd_path.read_text()}")
 
         try:
-            self._run_paup_command_file(AU_TEST_NEX_FN, AU_LOG_FN, timeout_sec=max(1800, 600 * num_trees / 10)) # Dynamic timeout
+            self._run_paup_commands(script_cmds, AU_TEST_NEX_FN, AU_LOG_FN,
+                                    timeout_sec=max(1800, 600 * num_trees / 10), # Dynamic timeout
+                                    session_setup=self._paup_model_setup_cmds) # Sessions start with per-job threads
             return self._parse_au_results(self.temp_path / AU_LOG_FN)
         except Exception as e:
             logger.error(f"AU test execution failed: {e}")
             return None
 
-    def _generate_and_score_constraint_tree(self, clade_taxa: list, tree_idx: int):
-        # Returns (relative_tree_filename_str_or_None, likelihood_float_or_None)
-        formatted_clade_taxa = [self._format_taxon_for_paup(t) for t in clade_taxa]
+    def _parse_au_results(self, au_log_path: Path):
+        """
+        Parses the AU test table that lscores writes to the PAUP* log.
+
+        Returns {tree_number: {'lnL': float, 'AU_pvalue': float or None}}, or None if no table was found.
+        """
+        try:
+            lines = au_log_path.read_text(errors='replace').splitlines()
+        except OSError as e:
+            logger.error(f"Could not read AU test log {au_log_path}: {e}")
+            return None
+
+        results = {}
+        au_col = None
+        for line in lines:
+            if au_col is None:
+                # Header such as "Tree  -ln L  Diff -ln L  ...  AU"; join the multi-word column names
+                if _AU_HEADER_RE.match(line):
+                    header = _SPACED_LNL_RE.sub('-lnL', line).replace('Diff -lnL', 'Diff-lnL').split()
+                    au_col = header.index('AU')
+                continue
+            tokens = [t.rstrip('*') for t in line.split() if t.strip('*')] # Drop significance markers
+            if not tokens or set(tokens[0]) <= set('-'): # Blank or separator line
+                if results: break # End of table
+                continue
+            if not tokens[0].isdigit() or len(tokens) < 2:
+                if results: break
+                continue
+            try:
+                lnl = float(tokens[1])
+            except ValueError:
+                continue
+            au_pvalue = None
+            if au_col < len(tokens):
+                try:
+                    au_pvalue = float(tokens[au_col])
+                except ValueError:
+                    pass # e.g. "(best)" where a value is missing
+            results[int(tokens[0])] = {'lnL': lnl, 'AU_pvalue': au_pvalue}
+
+        if not results:
+            logger.warning(f"No AU test table found in {au_log_path}")
+            return None
+        logger.info(f"Parsed AU test results for {len(results)} trees.")
+        return results
+
+    def _constraint_script_cmds(self, clade_taxa: list, tree_idx: int):
+        """Returns the PAUP* commands (after the script prefix) for one constraint search, or None to skip the clade."""
+        formatted_taxa = self._formatted_taxa
+        formatted_clade_taxa = [formatted_taxa.get(t) or self._format_taxon_for_paup(t) for t in clade_taxa]
         if not formatted_clade_taxa : # Should not happen if called correctly
             logger.warning(f"Constraint {tree_idx}: No taxa provided for clade. Skipping.")
-            return None, None
+            return None
 
-        # All taxa in alignment (already formatted by _format_taxon_for_paup in _convert_to_nexus if that logic was used)
-        # For safety, re-format here if needed or assume names are simple.
-        # Here, get raw IDs then format.
-        all_raw_taxa_ids = [rec.id for rec in self.alignment]
-        if len(clade_taxa) == len(all_raw_taxa_ids):
+        if len(clade_taxa) == self._num_taxa:
              logger.warning(f"Constraint {tree_idx}: Clade contains all taxa. Skipping as no outgroup possible for MONOPHYLY constraint.")
-             return None, None
+             return None
 
 
         clade_spec = "((" + ", ".join(formatted_clade_taxa) + "));"
 
         constr_tree_fn = f"constraint_tree_{tree_idx}.tre"
         constr_score_fn = f"constraint_score_{tree_idx}.txt"
-        constr_cmd_fn = f"constraint_search_{tree_idx}.nex"
-        constr_log_fn = f"paup_constraint_{tree_idx}.log"
+        constraint_name = f"clade_{tree_idx}" # Unique, so a persistent session never redefines a constraint
 
-        script_cmds = [f"execute {NEXUS_ALIGNMENT_FN};", self._get_paup_model_setup_cmds()]
-        script_cmds.extend([
-            f"constraints clade_constraint (MONOPHYLY) = {clade_spec}",
+        script_cmds = [ # Commands after the shared _job_script_prefix
+            f"constraints {constraint_name} (MONOPHYLY) = {clade_spec}",
             "set maxtrees=100 increase=auto;" # Sensible default for constrained search
-        ])
+        ]
 
         if self.user_paup_block is None: # Standard search
             script_cmds.extend([
                 "hsearch start=stepwise addseq=random nreps=1;", # Initial unconstrained to get a tree in memory
-                "hsearch start=1 enforce=yes converse=yes constraints=clade_constraint;",
+                f"hsearch start=1 enforce=yes converse=yes constraints={constraint_name};",
                 f"savetrees file={constr_tree_fn} format=newick brlens=yes replace=yes;",
                 f"lscores 1 / scorefile={constr_score_fn} replace=yes;"
             ])
@@ -700,43 +1607,82 @@ class MLDecayIndices:
                 script_cmds.append("hsearch start=stepwise addseq=random nreps=1;")
             # Add enforce to the existing search or a new one. This is tricky.
             # Simplest: add a new constrained search. User might need to adjust their block.
-            script_cmds.append("hsearch start=1 enforce=yes converse=yes constraints=clade_constraint;")
+            script_cmds.append(f"hsearch start=1 enforce=yes converse=yes constraints={constraint_name};")
             if "savetrees" not in block_lower:
                 script_cmds.append(f"savetrees file={constr_tree_fn} format=newick brlens=yes replace=yes;")
             if "lscores" not in block_lower and "lscore" not in block_lower:
                 script_cmds.append(f"lscores 1 / scorefile={constr_score_fn} replace=yes;")
 
-        paup_script_content = f"#NEXUS\nbegin paup;\n" + "\n".join(script_cmds) + "\nquit;\nend;\n"
-        cmd_file_path = self.temp_path / constr_cmd_fn
-        cmd_file_path.write_text(paup_script_content)
-        if self.debug: logger.debug(f"Constraint search {tree_idx} script ({cmd_file_path}):\n{paup_script_content}")
+        return script_cmds
 
-        try:
-            self._run_paup_command_file(constr_cmd_fn, constr_log_fn, timeout_sec=600)
+    def _collect_constraint_result(self, tree_idx: int, log_path: Path):
+        """Reads back the tree and score files of constraint search tree_idx after PAUP* has run."""
+        constr_tree_fn = f"constraint_tree_{tree_idx}.tre"
+        constrained_lnl = self._parse_likelihood_from_score_file(self.temp_path / f"constraint_score_{tree_idx}.txt")
+
+        tree_file_path = self.temp_path / constr_tree_fn
+        if tree_file_path.exists() and tree_file_path.stat().st_size > 0:
+            return constr_tree_fn, constrained_lnl # Return relative filename
+        logger.error(f"Constraint tree file {tree_file_path} (idx {tree_idx}) not found or empty.")
+        # Try to get LNL from log if score file failed and tree missing
+        if constrained_lnl is None:
+            constrained_lnl = self._likelihood_from_log(log_path)
+            if constrained_lnl: logger.info(f"Constraint {tree_idx}: LNL from log: {constrained_lnl} (tree file missing)")
+        return None, constrained_lnl
 
-            score_file_path = self.temp_path / constr_score_fn
-            constrained_lnl = self._parse_likelihood_from_score_file(score_file_path)
+    def _generate_and_score_constraint_tree(self, clade_taxa: list, tree_idx: int):
+        # Returns (relative_tree_filename_str_or_None, likelihood_float_or_None)
+        script_cmds = self._constraint_script_cmds(clade_taxa, tree_idx)
+        if script_cmds is None:
+            return None, None
 
-            tree_file_path = self.temp_path / constr_tree_fn
-            if tree_file_path.exists() and tree_file_path.stat().st_size > 0:
-                return constr_tree_fn, constrained_lnl # Return relative filename
-            else:
-                logger.error(f"Constraint tree file {tree_file_path} (idx {tree_idx}) not found or empty.")
-                # Try to get LNL from log if score file failed and tree missing
-                if constrained_lnl is None:
-                    log_content = (self.temp_path / constr_log_fn).read_text()
-                    patterns = [r'-ln\s*L\s*=\s*([0-9.]+)', r'likelihood\s*=\s*([0-9.]+)', r'score\s*=\s*([0-9.]+)']
-                    for p in patterns:
-                        m = re.findall(p, log_content, re.IGNORECASE)
-                        if m: constrained_lnl = float(m[-1]); break
-                    if constrained_lnl: logger.info(f"Constraint {tree_idx}: LNL from log: {constrained_lnl} (tree file missing)")
-                return None, constrained_lnl
+        constr_cmd_fn = f"constraint_search_{tree_idx}.nex"
+        constr_log_fn = f"paup_constraint_{tree_idx}.log"
+        cmd_file_path = self.temp_path / constr_cmd_fn
+        self._write_paup_script(cmd_file_path, self._job_script_prefix, script_cmds)
+        if self.debug: logger.debug(f"Constraint search {tree_idx} script ({cmd_file_path}):\n{cmd_file_path.read_text()}")
+
+        try:
+            self._run_paup_commands(script_cmds, constr_cmd_fn, constr_log_fn, timeout_sec=600)
+            return self._collect_constraint_result(tree_idx, self.temp_path / constr_log_fn)
         except Exception as e:
             logger.error(f"Constraint tree generation/scoring failed for index {tree_idx}: {e}")
             return None, None
 
-    def calculate_decay_indices(self, perform_site_analysis=False):
-        """Calculate ML decay indices for all internal branches of the ML tree."""
+    def _run_constraint_batch(self, constraint_tasks):
+        """
+        Runs every constraint search from one generated PAUP* script, so the alignment and model
+        are loaded once. Returns (tree_filename, lnL) per task, like _generate_and_score_constraint_tree.
+        """
+        batch_cmds = []
+        included = []
+        for clade_log_idx, clade_taxa_names in constraint_tasks:
+            script_cmds = self._constraint_script_cmds(clade_taxa_names, clade_log_idx)
+            if script_cmds is not None:
+                batch_cmds.extend(script_cmds)
+                included.append(clade_log_idx)
+
+        log_path = self.temp_path / CONSTRAINT_BATCH_LOG_FN
+        if included:
+            cmd_file_path = self.temp_path / CONSTRAINT_BATCH_NEX_FN
+            self._write_paup_script(cmd_file_path, self._script_prefix, batch_cmds)
+            if self.debug: logger.debug(f"Batched constraint script ({cmd_file_path}):\n{cmd_file_path.read_text()}")
+            logger.info(f"Running {len(included)} constraint searches in one PAUP* script.")
+            try:
+                self._run_paup_command_file(CONSTRAINT_BATCH_NEX_FN, CONSTRAINT_BATCH_LOG_FN, timeout_sec=600 * len(included))
+            except Exception as e: # Searches completed before the failure still left their files
+                logger.error(f"Batched constraint searches failed: {e}")
+
+        return [self._collect_constraint_result(clade_log_idx, log_path) if clade_log_idx in included else (None, None)
+                for clade_log_idx, _ in constraint_tasks]
+
+    def calculate_decay_indices(self, perform_site_analysis=False, compute_au=True):
+        """
+        Calculate ML decay indices for all internal branches of the ML tree.
+
+        With compute_au=False the AU test is skipped and the decay values use the likelihoods
+        already scored by the constraint searches, so no further PAUP* run is needed.
+        """
         if not self.ml_tree:
             logger.info("ML tree not available. Attempting to build it first...")
             try:
@@ -753,24 +1699,46 @@ class MLDecayIndices:
         all_tree_files_rel = [ML_TREE_FN] # ML tree is first
         constraint_info_map = {} # Maps clade_id_str to its info
 
-        internal_clades = [cl for cl in self.ml_tree.get_nonterminals() if cl and cl.clades] # Biphasic, non-empty
+        # (names in tree order, taxon set) per internal node in preorder, from the tokenizer when available
+        if self.ml_clade_taxa:
+            internal_clades = self.ml_clade_taxa
+        else:
+            names_by_node = {}
+            for node in self.ml_tree.find_clades(order='postorder'): # Children's names joined, not re-walked
+                names_by_node[id(node)] = (sum((names_by_node[id(child)] for child in node.clades), ())
+                                           if node.clades else (node.name,))
+            internal_clades = [(names_by_node[id(cl)], frozenset(names_by_node[id(cl)]))
+                               for cl in self.ml_tree.find_clades(terminal=False)] # Lazy preorder walk
         logger.info(f"ML tree has {len(internal_clades)} internal branches to test.")
         if not internal_clades:
             logger.warning("ML tree has no testable internal branches. No decay indices calculated.")
             return {}
 
-        for i, clade_obj in enumerate(internal_clades):
+        total_taxa_count = len(internal_clades[0][1]) # Preorder: the root clade holds every taxon
+        constraint_tasks = [] # (clade_log_idx, clade_taxa_names) for each non-trivial branch
+        for i, (clade_names, clade_taxa) in enumerate(internal_clades):
             clade_log_idx = i + 1 # For filenames and logging (1-based)
-            clade_taxa_names = [leaf.name for leaf in clade_obj.get_terminals()]
-            total_taxa_count = len(self.ml_tree.get_terminals())
+            clade_size = len(clade_taxa)
 
-            if len(clade_taxa_names) <= 1 or len(clade_taxa_names) >= total_taxa_count -1:
-                logger.info(f"Skipping trivial branch {clade_log_idx} (taxa: {len(clade_taxa_names)}/{total_taxa_count}).")
+            if clade_size <= 1 or clade_size >= total_taxa_count -1:
+                logger.info(f"Skipping trivial branch {clade_log_idx} (taxa: {clade_size}/{total_taxa_count}).")
                 continue
+            constraint_tasks.append((clade_log_idx, list(clade_names))) # Tree order, as get_terminals() gives
 
+        def run_constraint(task):
+            clade_log_idx, clade_taxa_names = task
             logger.info(f"Processing branch {clade_log_idx}/{len(internal_clades)} (taxa: {len(clade_taxa_names)})")
-            rel_constr_tree_fn, constr_lnl = self._generate_and_score_constraint_tree(clade_taxa_names, clade_log_idx)
+            return self._generate_and_score_constraint_tree(clade_taxa_names, clade_log_idx)
+
+        if self.batch_constraints:
+            constraint_results = self._run_constraint_batch(constraint_tasks)
+        else:
+            # Each constraint search is an independent PAUP* process with its own files,
+            # so a thread pool is enough to overlap them; results come back in task order.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                constraint_results = list(executor.map(run_constraint, constraint_tasks))
 
+        for (clade_log_idx, clade_taxa_names), (rel_constr_tree_fn, constr_lnl) in zip(constraint_tasks, constraint_results):
             if rel_constr_tree_fn: # Successfully generated and scored (even if LNL is None)
                 all_tree_files_rel.append(rel_constr_tree_fn)
                 clade_id_str = f"Clade_{clade_log_idx}"
@@ -780,6 +1748,7 @@ class MLDecayIndices:
 
                 constraint_info_map[clade_id_str] = {
                     'taxa': clade_taxa_names,
+                    'taxa_fs': internal_clades[clade_log_idx - 1][1], # Taxon set as a lookup key
                     'paup_tree_index': len(all_tree_files_rel), # 1-based index for PAUP*
                     'constrained_lnl': constr_lnl,
                     'lnl_diff': lnl_diff,
@@ -794,36 +1763,57 @@ class MLDecayIndices:
             return self.decay_indices
 
         # Perform site-specific likelihood analysis if requested
+        # Site likelihoods for all trees ride along with the AU test's single lscores call
+        if compute_au:
+            logger.info(f"Running AU test on {len(all_tree_files_rel)} trees (1 ML + {len(constraint_info_map)} constrained).")
+            au_test_results = self.run_au_test(all_tree_files_rel, site_likelihoods=perform_site_analysis)
+        else:
+            logger.info("Skipping AU test; decay values use the constrained likelihoods from the constraint searches.")
+            au_test_results = None
+
         if perform_site_analysis:
             logger.info("Performing site-specific likelihood analysis for each branch...")
 
-            for clade_id, cdata in list(constraint_info_map.items()):
-                rel_constr_tree_fn = cdata.get('tree_filename')
+            site_tasks = [(clade_id, cdata['tree_filename']) for clade_id, cdata in constraint_info_map.items()
+                          if cdata.get('tree_filename')]
 
-                if rel_constr_tree_fn:
-                    tree_files = [ML_TREE_FN, rel_constr_tree_fn]
-                    site_analysis_result = self._calculate_site_likelihoods(tree_files, clade_id)
+            au_score_path = self.temp_path / AU_TEST_SCORE_FN
+            site_lnl_by_tree = self._parse_site_likelihoods(au_score_path) if compute_au and au_score_path.exists() else {}
+            if 1 in site_lnl_by_tree:
+                site_results = [
+                    self._summarize_site_likelihoods(site_lnl_by_tree[1], site_lnl_by_tree.get(constraint_info_map[clade_id]['paup_tree_index']), clade_id)
+                    for clade_id, _ in site_tasks
+                ]
+            else: # Batched scores unavailable: score each branch against the ML tree separately
+                logger.info("Site likelihoods not found in AU test output; scoring each branch separately.")
 
-                    if site_analysis_result:
-                        # Store all site analysis data
-                        constraint_info_map[clade_id].update(site_analysis_result)
+                def run_site_analysis(task):
+                    clade_id, rel_constr_tree_fn = task
+                    return self._calculate_site_likelihoods([ML_TREE_FN, rel_constr_tree_fn], clade_id)
 
-                        # Log key results
-                        supporting = site_analysis_result.get('supporting_sites', 0)
-                        conflicting = site_analysis_result.get('conflicting_sites', 0)
-                        ratio = site_analysis_result.get('support_ratio', 0.0)
-                        weighted = site_analysis_result.get('weighted_support_ratio', 0.0)
+                # Like the constraint searches, each branch is a separate PAUP* run with its own files
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    site_results = list(executor.map(run_site_analysis, site_tasks))
 
-                        logger.info(f"Branch {clade_id}: {supporting} supporting sites, {conflicting} conflicting sites, ratio: {ratio:.2f}, weighted ratio: {weighted:.2f}")
+            for (clade_id, _), site_analysis_result in zip(site_tasks, site_results):
+                if site_analysis_result:
+                    # Store all site analysis data
+                    constraint_info_map[clade_id].update(site_analysis_result)
 
-        logger.info(f"Running AU test on {len(all_tree_files_rel)} trees (1 ML + {len(constraint_info_map)} constrained).")
-        au_test_results = self.run_au_test(all_tree_files_rel)
+                    # Log key results
+                    supporting = site_analysis_result.get('supporting_sites', 0)
+                    conflicting = site_analysis_result.get('conflicting_sites', 0)
+                    ratio = site_analysis_result.get('support_ratio', 0.0)
+                    weighted = site_analysis_result.get('weighted_support_ratio', 0.0)
+
+                    logger.info(f"Branch {clade_id}: {supporting} supporting sites, {conflicting} conflicting sites, ratio: {ratio:.2f}, weighted ratio: {weighted:.2f}")
 
         self.decay_indices = {}
         # Populate with LNL diffs first, then add AU results
         for cid, cdata in constraint_info_map.items():
             self.decay_indices[cid] = {
                 'taxa': cdata['taxa'],
+                'taxa_fs': cdata['taxa_fs'],
                 'lnl_diff': cdata['lnl_diff'],
                 'constrained_lnl': cdata['constrained_lnl'],
                 'AU_pvalue': None,
@@ -871,7 +1861,7 @@ class MLDecayIndices:
                             self.decay_indices[cid]['lnl_diff'] = au_constr_lnl - self.ml_likelihood
                 else:
                     logger.warning(f"No AU test result for PAUP tree index {paup_idx} (Clade: {cid}).")
-        else:
+        elif compute_au:
             logger.warning("AU test failed or returned no results. Decay indices will lack AU p-values.")
 
         if not self.decay_indices:
@@ -901,7 +1891,7 @@ class MLDecayIndices:
         site_log_file = f"site_analysis_{branch_id}.log"
 
         # Create PAUP* script for site likelihood calculation
-        script_cmds = [f"execute {NEXUS_ALIGNMENT_FN};", self._get_paup_model_setup_cmds()]
+        script_cmds = [] # Commands after the shared _job_script_prefix (branches may run concurrently)
 
         # Get both trees (ML and constrained)
         script_cmds.append(f"gettrees file={tree_files_list[0]} mode=3 storebrlens=yes;")
@@ -911,15 +1901,14 @@ class MLDecayIndices:
         script_cmds.append(f"lscores 1-2 / sitelikes=yes scorefile={site_lnl_file} replace=yes;")
 
         # Write PAUP* script
-        paup_script_content = f"#NEXUS\nbegin paup;\n" + "\n".join(script_cmds) + "\nquit;\nend;\n"
         script_path = self.temp_path / site_script_file
-        script_path.write_text(paup_script_content)
+        self._write_paup_script(script_path, self._job_script_prefix, script_cmds)
         if self.debug:
-            logger.debug(f"Site analysis script for {branch_id}:\n{paup_script_content}")
+            logger.debug(f"Site analysis script for {branch_id}:\n{script_path.read_text()}")
 
         try:
             # Run PAUP* to calculate site likelihoods
-            self._run_paup_command_file(site_script_file, site_log_file, timeout_sec=600)
+            self._run_paup_commands(script_cmds, site_script_file, site_log_file, timeout_sec=600)
 
             # Parse the site likelihood file
             site_lnl_path = self.temp_path / site_lnl_file
@@ -927,122 +1916,212 @@ class MLDecayIndices:
                 logger.warning(f"Site likelihood file not found for branch {branch_id}.")
                 return None
 
-            # Read the site likelihoods file
-            site_lnl_content = site_lnl_path.read_text()
+            site_lnl_by_tree = self._parse_site_likelihoods(site_lnl_path)
 
-            # Initialize dictionaries for tree likelihoods
-            tree1_lnl = {}
-            tree2_lnl = {}
+            # Make sure we found at least 2 tree sections (Tree 1 and Tree 2)
+            if len(site_lnl_by_tree) < 2:
+                logger.warning(f"Could not find enough tree headers in site likelihood file for branch {branch_id}")
+                if self.debug:
+                    with open(site_lnl_path) as f:
+                        logger.debug(f"Site likelihood file content (first 500 chars):\n{f.read(500)}...")
+                return None
 
-            # Define patterns to extract data from the file
-            # First pattern: Match the header line for each tree section
-            tree_header_pattern = r'(\d+)\t([-\d\.]+)\t-\t-'
+            return self._summarize_site_likelihoods(site_lnl_by_tree.get(1), site_lnl_by_tree.get(2), branch_id)
 
-            # Second pattern: Match site and likelihood lines (indented with tabs)
-            site_lnl_pattern = r'\t\t(\d+)\t([-\d\.]+)'
+        except Exception as e:
+            logger.error(f"Failed to calculate site likelihoods for branch {branch_id}: {e}")
+            if self.debug:
+                logger.debug(f"Traceback for site likelihood calculation error:\n{traceback.format_exc()}")
+            return None
 
-            # Find all tree headers
-            tree_headers = list(re.finditer(tree_header_pattern, site_lnl_content))
+    @staticmethod
+    def _parse_site_likelihoods(site_lnl_path: Path):
+        """Returns {tree_number: (site_numbers, site_lnls)} as NumPy arrays from a PAUP* sitelikes score file."""
+        # Each tree section starts with "tree<TAB>lnL<TAB>-<TAB>-", followed by "<TAB><TAB>site<TAB>lnL" rows.
+        # The file is streamed line by line, as it can be large for long alignments.
+        sites_by_tree, lnls_by_tree = {}, {}
+        sites = lnls = None
+        with open(site_lnl_path, 'r', buffering=1 << 20) as f:
+            for line in f:
+                if line.startswith('\t\t'):
+                    if sites is None: continue # Rows before any tree header
+                    parts = line.split('\t')
+                    try:
+                        site, lnl = int(parts[2]), float(parts[3])
+                    except (IndexError, ValueError):
+                        continue
+                    sites.append(site)
+                    lnls.append(lnl)
+                    continue
+                header_match = _SITE_TREE_HEADER_RE.match(line)
+                if header_match:
+                    tree_num = int(header_match.group(1))
+                    sites = sites_by_tree.setdefault(tree_num, [])
+                    lnls = lnls_by_tree.setdefault(tree_num, [])
+        return {
+            tree_num: (np.array(sites_by_tree[tree_num], dtype=np.int64), np.array(lnls_by_tree[tree_num], dtype=np.float64))
+            for tree_num in sites_by_tree
+        }
+
+    def _summarize_site_likelihoods(self, tree1_lnl, tree2_lnl, branch_id):
+        """
+        Compares per-site likelihoods of the ML tree and a constrained tree.
 
-            # Make sure we found at least 2 tree headers (Tree 1 and Tree 2)
-            if len(tree_headers) < 2:
-                logger.warning(f"Could not find enough tree headers in site likelihood file for branch {branch_id}")
-                if self.debug:
-                    logger.debug(f"Site likelihood file content (first 500 chars):\n{site_lnl_content[:500]}...")
-                return None
+        tree1_lnl and tree2_lnl are (site_numbers, site_lnls) array pairs as returned by
+        _parse_site_likelihoods for the ML and constrained tree respectively.
+        """
+        # Check if we have data for both trees
+        if tree1_lnl is None or not len(tree1_lnl[0]):
+            logger.warning(f"No data found for Tree 1 in site likelihood file for branch {branch_id}")
+            return None
+
+        if tree2_lnl is None or not len(tree2_lnl[0]):
+            logger.warning(f"No data found for Tree 2 in site likelihood file for branch {branch_id}")
+            return None
 
-            # Process each tree section
-            for i, header_match in enumerate(tree_headers[:2]):  # Only process the first two trees
-                tree_num = int(header_match.group(1))
+        # Align the two trees on their common sites (sorted by site number)
+        all_sites, idx1, idx2 = np.intersect1d(tree1_lnl[0], tree2_lnl[0], assume_unique=True, return_indices=True)
+        if not all_sites.size:
+            logger.warning(f"No comparable site likelihoods found for branch {branch_id}")
+            return None
+        ml_lnl = tree1_lnl[1][idx1]
+        constrained_lnl = tree2_lnl[1][idx2]
+        deltas = ml_lnl - constrained_lnl
+
+        # Per-site records with the differences, ordered by site number
+        site_data = np.empty(all_sites.size, dtype=_SITE_DATA_DTYPE)
+        site_data['site'] = all_sites
+        site_data['lnL_ML'] = ml_lnl
+        site_data['lnL_constrained'] = constrained_lnl
+        site_data['delta_lnL'] = deltas
+        site_data['supports_branch'] = deltas < 0  # Negative delta means site supports ML branch
+
+        # Calculate summary statistics
+        supporting_mask = deltas < 0
+        conflicting_mask = deltas > 0
+        supporting_sites = int(supporting_mask.sum())
+        conflicting_sites = int(conflicting_mask.sum())
+        neutral_sites = int((np.abs(deltas) < 1e-6).sum())
+
+        # Calculate sum of likelihood differences
+        sum_supporting_delta = float(deltas[supporting_mask].sum())  # Sum of negative deltas (supporting)
+        sum_conflicting_delta = float(deltas[conflicting_mask].sum())  # Sum of positive deltas (conflicting)
+
+        # Calculate weighted support ratio
+        weighted_support_ratio = abs(sum_supporting_delta) / sum_conflicting_delta if sum_conflicting_delta > 0 else float('inf')
+
+        # Calculate standard support ratio
+        support_ratio = supporting_sites / conflicting_sites if conflicting_sites > 0 else float('inf')
+
+        if logger.isEnabledFor(logging.INFO): # Skip formatting per-branch lines when INFO is silenced
+            logger.info(f"Extracted site likelihoods for {len(site_data)} sites for branch {branch_id}")
+            logger.info(f"Branch {branch_id}: {supporting_sites} supporting sites, {conflicting_sites} conflicting sites, ratio: {support_ratio:.2f}")
+            logger.info(f"Branch {branch_id}: Sum supporting delta: {sum_supporting_delta:.4f}, sum conflicting: {sum_conflicting_delta:.4f}, weighted ratio: {weighted_support_ratio:.2f}")
+
+        # Return a comprehensive dictionary with all info
+        return {
+            'site_data': site_data,
+            'supporting_sites': supporting_sites,
+            'conflicting_sites': conflicting_sites,
+            'neutral_sites': neutral_sites,
+            'support_ratio': support_ratio,
+            'sum_supporting_delta': sum_supporting_delta,
+            'sum_conflicting_delta': sum_conflicting_delta,
+            'weighted_support_ratio': weighted_support_ratio
+        }
 
-                # If there's a next header, read up to it; otherwise, read to the end
-                if i < len(tree_headers) - 1:
-                    section_text = site_lnl_content[header_match.end():tree_headers[i+1].start()]
-                else:
-                    section_text = site_lnl_content[header_match.end():]
+    @staticmethod
+    def _nonterminal_taxa_sets(tree):
+        """Returns (node, frozenset of descendant taxon names) for each internal node, in one postorder pass."""
+        taxa_by_node = {}
+        result = []
+        for node in tree.find_clades(order='postorder'):
+            if node.clades:
+                taxa = frozenset().union(*(taxa_by_node[id(child)] for child in node.clades))
+                result.append((node, taxa))
+            else:
+                taxa = frozenset([node.name])
+            taxa_by_node[id(node)] = taxa
+        return result
 
-                # Find all site and likelihood entries
-                site_matches = re.finditer(site_lnl_pattern, section_text)
+    @staticmethod
+    def _internal_nodes(tree):
+        """Returns the internal nodes of tree in the same postorder as _nonterminal_taxa_sets."""
+        return [node for node in tree.find_clades(order='postorder') if node.clades]
 
-                # Store data in appropriate dictionary
-                for site_match in site_matches:
-                    site_num = int(site_match.group(1))
-                    lnl_val = float(site_match.group(2))
+    def _decay_by_taxa(self):
+        """
+        Maps each clade's taxon set to its decay_indices entry, for O(1) lookup per tree node.
+        Rebuilt when decay_indices is replaced or gains/loses entries; the entries themselves are shared.
+        """
+        cached = getattr(self, '_decay_taxa_cache', None)
+        if cached is None or cached[0] is not self.decay_indices or cached[1] != len(self.decay_indices):
+            index = {d.get('taxa_fs') or frozenset(d['taxa']): d for d in self.decay_indices.values() if 'taxa' in d}
+            self._decay_taxa_cache = cached = (self.decay_indices, len(self.decay_indices), index)
+        return cached[2]
 
-                    if tree_num == 1:
-                        tree1_lnl[site_num] = lnl_val
-                    else:
-                        tree2_lnl[site_num] = lnl_val
+    def _sorted_decay_items(self):
+        """
+        Returns decay_indices items sorted by clade ID, shared by the result writers.
+        Re-sorted when decay_indices is replaced or gains/loses entries.
+        """
+        cached = getattr(self, '_sorted_decay_cache', None)
+        if cached is None or cached[0] is not self.decay_indices or cached[1] != len(self.decay_indices):
+            self._sorted_decay_cache = cached = (self.decay_indices, len(self.decay_indices), tuple(sorted(self.decay_indices.items())))
+        return cached[2]
 
-            # Check if we have data for both trees
-            if not tree1_lnl:
-                logger.warning(f"No data found for Tree 1 in site likelihood file for branch {branch_id}")
-                return None
+    def _bootstrap_values_by_taxa(self):
+        """
+        Maps the taxon set of each clade in the bootstrap consensus tree to its support value.
+        Computed once per bootstrap tree; callers must not modify the returned dict.
+        """
+        bootstrap_tree = self.bootstrap_tree
+        if bootstrap_tree is None:
+            return {}
+        cached = getattr(self, '_bootstrap_taxa_cache', None)
+        if cached is None or cached[0] is not bootstrap_tree: # Recompute if the tree was replaced
+            values = {taxa: node.confidence for node, taxa in self._nonterminal_taxa_sets(bootstrap_tree)
+                      if node.confidence is not None}
+            self._bootstrap_taxa_cache = cached = (bootstrap_tree, values)
+        return cached[1]
+
+    def _ml_newick(self):
+        """
+        Returns the ML tree serialised as Newick text.
+        Computed once per ML tree, so per-clade writers do not re-serialise it.
+        """
+        cached = getattr(self, '_ml_newick_cache', None)
+        if cached is None or cached[0] is not self.ml_tree: # Recompute if the tree was replaced
+            self._ml_newick_cache = cached = (self.ml_tree, self.ml_tree.format("newick"))
+        return cached[1]
 
-            if not tree2_lnl:
-                logger.warning(f"No data found for Tree 2 in site likelihood file for branch {branch_id}")
-                return None
+    def _build_annotations(self, clade_taxa, clade_decay):
+        """
+        Returns the FigTree label ("BS:..|AU:..|LnL:..") for each internal node, or None where
+        there is nothing to show. clade_taxa and clade_decay are parallel per-node lists.
+        """
+        bootstrap_values = self._bootstrap_values_by_taxa()
+        node_annotations = []
+        for node_taxa_set, decay_info in zip(clade_taxa, clade_decay):
+            annotation_parts = []
 
-            # Create the site_data dictionary with differences
-            site_data = {}
-            all_sites = sorted(set(tree1_lnl.keys()) & set(tree2_lnl.keys()))
+            # Add bootstrap value if available
+            if node_taxa_set in bootstrap_values:
+                annotation_parts.append(f"BS:{int(bootstrap_values[node_taxa_set])}")
 
-            for site_num in all_sites:
-                ml_lnl = tree1_lnl[site_num]
-                constrained_lnl = tree2_lnl[site_num]
-                delta_lnl = ml_lnl - constrained_lnl
+            # Add AU and LnL values if available
+            if decay_info:
+                au_val = decay_info.get('AU_pvalue')
+                lnl_val = decay_info.get('lnl_diff')
 
-                site_data[site_num] = {
-                    'lnL_ML': ml_lnl,
-                    'lnL_constrained': constrained_lnl,
-                    'delta_lnL': delta_lnl,
-                    'supports_branch': delta_lnl < 0  # Negative delta means site supports ML branch
-                }
+                if au_val is not None:
+                    annotation_parts.append(f"AU:{au_val:.4f}")
 
-            # Calculate summary statistics
-            if site_data:
-                deltas = [site_info['delta_lnL'] for site_info in site_data.values()]
-
-                supporting_sites = sum(1 for d in deltas if d < 0)
-                conflicting_sites = sum(1 for d in deltas if d > 0)
-                neutral_sites = sum(1 for d in deltas if abs(d) < 1e-6)
-
-                # Calculate sum of likelihood differences
-                sum_supporting_delta = sum(d for d in deltas if d < 0)  # Sum of negative deltas (supporting)
-                sum_conflicting_delta = sum(d for d in deltas if d > 0)  # Sum of positive deltas (conflicting)
-
-                # Calculate weighted support ratio
-                weighted_support_ratio = abs(sum_supporting_delta) / sum_conflicting_delta if sum_conflicting_delta > 0 else float('inf')
-
-                # Calculate standard support ratio
-                support_ratio = supporting_sites / conflicting_sites if conflicting_sites > 0 else float('inf')
-
-                logger.info(f"Extracted site likelihoods for {len(site_data)} sites for branch {branch_id}")
-                logger.info(f"Branch {branch_id}: {supporting_sites} supporting sites, {conflicting_sites} conflicting sites")
-                logger.info(f"Branch {branch_id}: {supporting_sites} supporting sites, {conflicting_sites} conflicting sites, ratio: {support_ratio:.2f}")
-                logger.info(f"Branch {branch_id}: Sum supporting delta: {sum_supporting_delta:.4f}, sum conflicting: {sum_conflicting_delta:.4f}, weighted ratio: {weighted_support_ratio:.2f}")
-
-                # Return a comprehensive dictionary with all info
-                return {
-                    'site_data': site_data,
-                    'supporting_sites': supporting_sites,
-                    'conflicting_sites': conflicting_sites,
-                    'neutral_sites': neutral_sites,
-                    'support_ratio': support_ratio,
-                    'sum_supporting_delta': sum_supporting_delta,
-                    'sum_conflicting_delta': sum_conflicting_delta,
-                    'weighted_support_ratio': weighted_support_ratio
-                }
-            else:
-                logger.warning(f"No comparable site likelihoods found for branch {branch_id}")
-                return None
+                if lnl_val is not None:
+                    annotation_parts.append(f"LnL:{abs(lnl_val):.4f}")
 
-        except Exception as e:
-            logger.error(f"Failed to calculate site likelihoods for branch {branch_id}: {e}")
-            if self.debug:
-                import traceback
-                logger.debug(f"Traceback for site likelihood calculation error:\n{traceback.format_exc()}")
-            return None
+            node_annotations.append("|".join(annotation_parts) if annotation_parts else None)
+        return node_annotations
 
     def annotate_trees(self, output_dir: Path, base_filename: str = "annotated_tree"):
         """
@@ -1066,29 +2145,25 @@ class MLDecayIndices:
 
         output_dir.mkdir(parents=True, exist_ok=True)
         tree_files = {}
+        # Decay results keyed by clade taxon set, for O(1) lookup per tree node
+        taxa_index = self._decay_by_taxa()
 
         try:
+            # Each variant below annotates its own deep copy of the ML tree, which is never modified.
+            # Per-internal-node arrays in postorder: the copies keep that node order,
+            # so each variant is annotated by position without recomputing taxon sets.
+            base_tree = self.ml_tree
+            clade_taxa = [taxa for _, taxa in self._nonterminal_taxa_sets(base_tree)]
+            clade_decay = [taxa_index.get(taxa) for taxa in clade_taxa]
+
             # Create AU p-value annotated tree
             au_tree_path = output_dir / f"{base_filename}_au.nwk"
             try:
                 # Work on a copy to avoid modifying self.ml_tree
-                temp_tree_for_au = self.temp_path / f"ml_tree_for_au_annotation.nwk"
-                Phylo.write(self.ml_tree, str(temp_tree_for_au), "newick")
-                cleaned_tree_path = self._clean_newick_tree(temp_tree_for_au)
-                au_tree = Phylo.read(str(cleaned_tree_path), "newick")
+                au_tree = copy.deepcopy(base_tree)
 
                 annotated_nodes_count = 0
-                for node in au_tree.get_nonterminals():
-                    if not node or not node.clades: continue
-                    node_taxa_set = set(leaf.name for leaf in node.get_terminals())
-
-                    # Find matching entry in decay_indices by taxa set
-                    matched_data = None
-                    for decay_id_str, decay_info in self.decay_indices.items():
-                        if 'taxa' in decay_info and set(decay_info['taxa']) == node_taxa_set:
-                            matched_data = decay_info
-                            break
-
+                for node, matched_data in zip(self._internal_nodes(au_tree), clade_decay):
                     node.confidence = None  # Default
                     if matched_data and 'AU_pvalue' in matched_data and matched_data['AU_pvalue'] is not None:
                         node.confidence = float(matched_data['AU_pvalue'])
@@ -1103,22 +2178,10 @@ class MLDecayIndices:
             # Create log-likelihood difference annotated tree
             lnl_tree_path = output_dir / f"{base_filename}_lnl.nwk"
             try:
-                temp_tree_for_lnl = self.temp_path / f"ml_tree_for_lnl_annotation.nwk"
-                Phylo.write(self.ml_tree, str(temp_tree_for_lnl), "newick")
-                cleaned_tree_path = self._clean_newick_tree(temp_tree_for_lnl)
-                lnl_tree = Phylo.read(str(cleaned_tree_path), "newick")
+                lnl_tree = copy.deepcopy(base_tree)
 
                 annotated_nodes_count = 0
-                for node in lnl_tree.get_nonterminals():
-                    if not node or not node.clades: continue
-                    node_taxa_set = set(leaf.name for leaf in node.get_terminals())
-
-                    matched_data = None
-                    for decay_id_str, decay_info in self.decay_indices.items():
-                        if 'taxa' in decay_info and set(decay_info['taxa']) == node_taxa_set:
-                            matched_data = decay_info
-                            break
-
+                for node, matched_data in zip(self._internal_nodes(lnl_tree), clade_decay):
                     node.confidence = None  # Default
                     if matched_data and 'lnl_diff' in matched_data and matched_data['lnl_diff'] is not None:
                         node.confidence = abs(matched_data['lnl_diff'])
@@ -1132,72 +2195,22 @@ class MLDecayIndices:
 
             # Create combined annotation tree manually for FigTree
             combined_tree_path = output_dir / f"{base_filename}_combined.nwk"
+            combined_tree = None # Shared with the comprehensive tree, which carries the same labels
             try:
-                # For the combined approach, we'll directly modify the Newick string
-                # First, get both trees as strings
-                temp_tree_for_combined = self.temp_path / f"ml_tree_for_combined_annotation.nwk"
-                Phylo.write(self.ml_tree, str(temp_tree_for_combined), "newick")
-
-                # Create a mapping from node taxa sets to combined annotation strings
-                node_annotations = {}
-
-                # If bootstrap analysis was performed, get bootstrap values first
-                bootstrap_values = {}
-                if hasattr(self, 'bootstrap_tree') and self.bootstrap_tree:
-                    for node in self.bootstrap_tree.get_nonterminals():
-                        if node.confidence is not None:
-                            taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-                            bootstrap_values[taxa_set] = node.confidence
-
-                for node in self.ml_tree.get_nonterminals():
-                    if not node or not node.clades: continue
-                    node_taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-
-                    # Initialize annotation parts
-                    annotation_parts = []
-
-                    # Add bootstrap value if available
-                    if bootstrap_values and node_taxa_set in bootstrap_values:
-                        bs_val = bootstrap_values[node_taxa_set]
-                        annotation_parts.append(f"BS:{int(bs_val)}")
-
-                    # Add AU and LnL values if available
-                    for decay_id_str, decay_info in self.decay_indices.items():
-                        if 'taxa' in decay_info and frozenset(decay_info['taxa']) == node_taxa_set:
-                            au_val = decay_info.get('AU_pvalue')
-                            lnl_val = decay_info.get('lnl_diff')
-
-                            if au_val is not None:
-                                annotation_parts.append(f"AU:{au_val:.4f}")
-
-                            if lnl_val is not None:
-                                annotation_parts.append(f"LnL:{abs(lnl_val):.4f}")
-                            break
-
-                    # Only add to annotations if we have at least one value
-                    if annotation_parts:
-                        node_annotations[node_taxa_set] = "|".join(annotation_parts)
+                node_annotations = self._build_annotations(clade_taxa, clade_decay)
 
-                # Now, we'll manually construct a combined Newick string
-                # Read the base tree without annotations
-                base_tree_str = temp_tree_for_combined.read_text()
-
-                # We'll create a combined tree by using string replacement on the base tree
-                # First, make a working copy of the ML tree
-                cleaned_tree_path = self._clean_newick_tree(temp_tree_for_combined)
-                combined_tree = Phylo.read(str(cleaned_tree_path), "newick")
+                # Make a working copy of the ML tree
+                combined_tree = copy.deepcopy(base_tree)
 
                 # Add our custom annotations
                 annotated_nodes_count = 0
-                for node in combined_tree.get_nonterminals():
-                    if not node or not node.clades: continue
-                    node_taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
+                for node, annotation in zip(self._internal_nodes(combined_tree), node_annotations):
 
-                    if node_taxa_set in node_annotations:
+                    if annotation:
                         # We need to use string values for combined annotation
                         # Save our combined annotation as a string in .name instead of .confidence
                         # This is a hack that works with some tree viewers including FigTree
-                        node.name = node_annotations[node_taxa_set]
+                        node.name = annotation
                         annotated_nodes_count += 1
 
                 # Write the modified tree
@@ -1206,12 +2219,12 @@ class MLDecayIndices:
                 logger.info(f"Annotated tree with {annotated_nodes_count} branch values written to {combined_tree_path} (type: combined).")
                 tree_files['combined'] = combined_tree_path
             except Exception as e:
+                combined_tree = None
                 logger.error(f"Failed to create combined tree: {e}")
-                import traceback
-                logger.debug(f"Traceback: {traceback.format_exc()}")
+                if self.debug: logger.debug(f"Traceback: {traceback.format_exc()}")
 
             # Handle bootstrap tree if bootstrap analysis was performed
-            if hasattr(self, 'bootstrap_tree') and self.bootstrap_tree:
+            if self.has_bootstrap:
                 # 1. Save the bootstrap tree directly
                 bootstrap_tree_path = output_dir / f"{base_filename}_bootstrap.nwk"
                 try:
@@ -1221,85 +2234,49 @@ class MLDecayIndices:
                 except Exception as e:
                     logger.error(f"Failed to write bootstrap tree: {e}")
 
-                # 2. Create a comprehensive tree with bootstrap, AU and LnL values
+                # 2. Write the comprehensive tree with bootstrap, AU and LnL values.
+                # With a bootstrap tree present the combined labels already include BS, so the
+                # combined tree is written again rather than annotated a second time.
                 comprehensive_tree_path = output_dir / f"{base_filename}_comprehensive.nwk"
                 try:
-                    temp_tree_for_comprehensive = self.temp_path / f"ml_tree_for_comprehensive_annotation.nwk"
-                    Phylo.write(self.ml_tree, str(temp_tree_for_comprehensive), "newick")
-                    cleaned_tree_path = self._clean_newick_tree(temp_tree_for_comprehensive)
-                    comprehensive_tree = Phylo.read(str(cleaned_tree_path), "newick")
-
-                    # Get bootstrap values for each clade
-                    bootstrap_values = {}
-                    for node in self.bootstrap_tree.get_nonterminals():
-                        if node.confidence is not None:
-                            taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-                            bootstrap_values[taxa_set] = node.confidence
-
-                    # Create comprehensive annotations
-                    node_annotations = {}
-                    for node in self.ml_tree.get_nonterminals():
-                        if not node or not node.clades: continue
-                        node_taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-
-                        # Find matching decay info
-                        matched_data = None
-                        for decay_id_str, decay_info in self.decay_indices.items():
-                            if 'taxa' in decay_info and frozenset(decay_info['taxa']) == node_taxa_set:
-                                matched_data = decay_info
-                                break
-
-                        # Combine all values
-                        annotation_parts = []
-
-                        # Add bootstrap value if available
-                        if node_taxa_set in bootstrap_values:
-                            bs_val = bootstrap_values[node_taxa_set]
-                            annotation_parts.append(f"BS:{int(bs_val)}")
-
-                        # Add AU and LnL values if available
-                        if matched_data:
-                            au_val = matched_data.get('AU_pvalue')
-                            lnl_val = matched_data.get('lnl_diff')
-
-                            if au_val is not None:
-                                annotation_parts.append(f"AU:{au_val:.4f}")
-
-                            if lnl_val is not None:
-                                annotation_parts.append(f"LnL:{abs(lnl_val):.4f}")
-
-                        if annotation_parts:
-                            node_annotations[node_taxa_set] = "|".join(annotation_parts)
-
-                    # Apply annotations to tree
-                    annotated_nodes_count = 0
-                    for node in comprehensive_tree.get_nonterminals():
-                        if not node or not node.clades: continue
-                        node_taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-
-                        if node_taxa_set in node_annotations:
-                            node.name = node_annotations[node_taxa_set]
-                            annotated_nodes_count += 1
-
-                    # Write the tree
-                    Phylo.write(comprehensive_tree, str(comprehensive_tree_path), "newick")
+                    if combined_tree is None:
+                        raise RuntimeError("combined annotations are unavailable")
+                    Phylo.write(combined_tree, str(comprehensive_tree_path), "newick")
                     logger.info(f"Comprehensive tree with {annotated_nodes_count} branch values written to {comprehensive_tree_path}")
                     tree_files['comprehensive'] = comprehensive_tree_path
                 except Exception as e:
                     logger.error(f"Failed to create comprehensive tree: {e}")
                     if self.debug:
-                        import traceback
                         logger.debug(f"Traceback: {traceback.format_exc()}")
 
             return tree_files
 
         except Exception as e:
             logger.error(f"Failed to annotate trees: {e}")
-            if hasattr(self, 'debug') and self.debug:
-                import traceback
+            if self.debug:
                 logger.debug(f"Traceback: {traceback.format_exc()}")
             return tree_files  # Return any successfully created files
 
+    @staticmethod
+    def _format_support_fields(data, bootstrap_values=None, significant_label="Yes"):
+        """
+        Formats the table cells of one decay_indices entry for the results file and report:
+        (constrained lnL, lnL difference, AU p-value, AU significance, bootstrap or None).
+        """
+        def fmt(value):
+            return f"{value:.4f}" if isinstance(value, float) else value
+
+        sig_au = data.get('significant_AU', 'N/A')
+        if isinstance(sig_au, bool): sig_au = significant_label if sig_au else "No"
+
+        bs_val = None
+        if bootstrap_values is not None:
+            bs_val = bootstrap_values.get(data.get('taxa_fs') or frozenset(data.get('taxa', [])), "N/A")
+            if isinstance(bs_val, (int, float)): bs_val = f"{int(bs_val)}"
+
+        return (fmt(data.get('constrained_lnl', 'N/A')), fmt(data.get('lnl_diff', 'N/A')),
+                fmt(data.get('AU_pvalue', 'N/A')), sig_au, bs_val)
+
     def write_results(self, output_path: Path):
         if not self.decay_indices:
             logger.warning("No branch support results to write.")
@@ -1316,10 +2293,10 @@ class MLDecayIndices:
                 return
 
         # Check if bootstrap analysis was performed
-        has_bootstrap = hasattr(self, 'bootstrap_tree') and self.bootstrap_tree
+        has_bootstrap = self.has_bootstrap
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        with output_path.open('w') as f:
+        with output_path.open('w', buffering=1 << 20) as f:
             f.write("MLDecay Branch Support Analysis\n")
             f.write("=" * 30 + "\n\n")
             ml_l = self.ml_likelihood if self.ml_likelihood is not None else "N/A"
@@ -1336,42 +2313,15 @@ class MLDecayIndices:
             f.write(header)
 
             # Create mapping of taxa sets to bootstrap values if bootstrap analysis was performed
-            bootstrap_values = {}
-            if has_bootstrap:
-                for node in self.bootstrap_tree.get_nonterminals():
-                    if node.confidence is not None:
-                        taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-                        bootstrap_values[taxa_set] = node.confidence
+            bootstrap_values = self._bootstrap_values_by_taxa() if has_bootstrap else None
 
-            for clade_id, data in sorted(self.decay_indices.items()): # Sort for consistent output
+            for clade_id, data in self._sorted_decay_items(): # Sort for consistent output
                 taxa_list = sorted(data.get('taxa', []))
-                taxa_str = ",".join(taxa_list)
-                num_taxa = len(taxa_list)
-
-                c_lnl = data.get('constrained_lnl', 'N/A')
-                if isinstance(c_lnl, float): c_lnl = f"{c_lnl:.4f}"
+                c_lnl, lnl_d, au_p, sig_au, bs_val = self._format_support_fields(data, bootstrap_values)
 
-                lnl_d = data.get('lnl_diff', 'N/A')
-                if isinstance(lnl_d, float): lnl_d = f"{lnl_d:.4f}"
-
-                au_p = data.get('AU_pvalue', 'N/A')
-                if isinstance(au_p, float): au_p = f"{au_p:.4f}"
-
-                sig_au = data.get('significant_AU', 'N/A')
-                if isinstance(sig_au, bool): sig_au = "Yes" if sig_au else "No"
-
-                row = f"{clade_id}\t{num_taxa}\t{c_lnl}\t{lnl_d}\t{au_p}\t{sig_au}"
-
-                # Add bootstrap value if available
-                if has_bootstrap:
-                    taxa_set = frozenset(taxa_list)
-                    bs_val = bootstrap_values.get(taxa_set, "N/A")
-                    if isinstance(bs_val, (int, float)):
-                        bs_val = f"{int(bs_val)}"
-                    row += f"\t{bs_val}"
-
-                row += f"\t{taxa_str}\n"
-                f.write(row)
+                row = f"{clade_id}\t{len(taxa_list)}\t{c_lnl}\t{lnl_d}\t{au_p}\t{sig_au}"
+                if has_bootstrap: row += f"\t{bs_val}"
+                f.write(f"{row}\t{','.join(taxa_list)}\n")
 
         logger.info(f"Results written to {output_path}")
 
@@ -1388,10 +2338,10 @@ class MLDecayIndices:
                  return
 
         # Check if bootstrap analysis was performed
-        has_bootstrap = hasattr(self, 'bootstrap_tree') and self.bootstrap_tree
+        has_bootstrap = self.has_bootstrap
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        with output_path.open('w') as f:
+        with output_path.open('w', buffering=1 << 20) as f: # Sections are written as they are formatted
             f.write(f"# ML-Decay Branch Support Analysis Report (v{VERSION})\n\n")
             f.write(f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
 
@@ -1441,43 +2391,18 @@ class MLDecayIndices:
             f.write(separator)
 
             # Get bootstrap values if bootstrap analysis was performed
-            bootstrap_values = {}
-            if has_bootstrap:
-                for node in self.bootstrap_tree.get_nonterminals():
-                    if node.confidence is not None:
-                        taxa_set = frozenset(leaf.name for leaf in node.get_terminals())
-                        bootstrap_values[taxa_set] = node.confidence
+            bootstrap_values = self._bootstrap_values_by_taxa() if has_bootstrap else None
 
-            for clade_id, data in sorted(self.decay_indices.items()):
+            for clade_id, data in self._sorted_decay_items():
                 taxa_list = sorted(data.get('taxa', []))
                 taxa_count = len(taxa_list)
                 taxa_sample = ", ".join(taxa_list[:3]) + ('...' if taxa_count > 3 else '')
-
-                c_lnl = data.get('constrained_lnl', 'N/A')
-                if isinstance(c_lnl, float): c_lnl = f"{c_lnl:.4f}"
-
-                lnl_d = data.get('lnl_diff', 'N/A')
-                if isinstance(lnl_d, float): lnl_d = f"{lnl_d:.4f}"
-
-                au_p = data.get('AU_pvalue', 'N/A')
-                if isinstance(au_p, float): au_p = f"{au_p:.4f}"
-
-                sig_au = data.get('significant_AU', 'N/A')
-                if isinstance(sig_au, bool): sig_au = "**Yes**" if sig_au else "No"
+                c_lnl, lnl_d, au_p, sig_au, bs_val = self._format_support_fields(data, bootstrap_values, "**Yes**")
 
                 # Build the table row
                 row = f"| {clade_id} | {taxa_count} | {c_lnl} | {lnl_d} | {au_p} | {sig_au} "
-
-                # Add bootstrap column if available
-                if has_bootstrap:
-                    taxa_set = frozenset(taxa_list)
-                    bs_val = bootstrap_values.get(taxa_set, "N/A")
-                    if isinstance(bs_val, (int, float)):
-                        bs_val = f"{int(bs_val)}"
-                    row += f"| {bs_val} "
-
-                row += f"| {taxa_sample} |\n"
-                f.write(row)
+                if has_bootstrap: row += f"| {bs_val} "
+                f.write(f"{row}| {taxa_sample} |\n")
 
             f.write("\n## Interpretation Guide\n\n")
             f.write("- **LnL Diff from ML**: Log-likelihood of the best tree *without* the clade minus ML tree's log-likelihood. More negative (larger absolute difference) implies stronger support for the clade's presence in the ML tree.\n")
@@ -1486,13 +2411,14 @@ class MLDecayIndices:
                 f.write("- **Bootstrap**: Bootstrap support value (percentage of bootstrap replicates in which the clade appears). Higher values (e.g., > 70) suggest stronger support for the clade.\n")
         logger.info(f"Detailed report written to {output_path}")
 
-    def write_site_analysis_results(self, output_dir: Path, keep_tree_files=False):
+    def write_site_analysis_results(self, output_dir: Path, keep_tree_files=False, archive=False):
         """
         Write site-specific likelihood analysis results to files.
 
         Args:
             output_dir: Directory to save the site analysis files
             keep_tree_files: Whether to keep the Newick files used for HTML visualization
+            archive: Store the per-clade site tables in one uncompressed tar instead of one file each
         """
         if not self.decay_indices:
             logger.warning("No decay indices available for site analysis output.")
@@ -1513,7 +2439,8 @@ class MLDecayIndices:
             f.write("=========================\n\n")
             f.write("Clade_ID\tSupporting_Sites\tConflicting_Sites\tNeutral_Sites\tSupport_Ratio\tSum_Supporting_Delta\tSum_Conflicting_Delta\tWeighted_Support_Ratio\n")
 
-            for clade_id, data in sorted(self.decay_indices.items()):
+            rows = [] # Written in one call once all rows are formatted
+            for clade_id, data in self._sorted_decay_items():
                 if 'site_data' not in data:
                     continue
 
@@ -1535,66 +2462,68 @@ class MLDecayIndices:
                 else:
                     weighted_ratio_str = f"{weighted_ratio:.4f}"
 
-                f.write(f"{clade_id}\t{supporting}\t{conflicting}\t{neutral}\t{ratio_str}\t{sum_supporting:.4f}\t{sum_conflicting:.4f}\t{weighted_ratio_str}\n")
+                rows.append(f"{clade_id}\t{supporting}\t{conflicting}\t{neutral}\t{ratio_str}\t{sum_supporting:.4f}\t{sum_conflicting:.4f}\t{weighted_ratio_str}\n")
+            f.writelines(rows)
 
         logger.info(f"Site analysis summary written to {summary_path}")
 
         # For each branch, write detailed site data
-        for clade_id, data in self.decay_indices.items():
-            if 'site_data' not in data:
-                continue
+        archive_path = output_dir / SITE_DATA_ARCHIVE_FN
+        with (tarfile.open(archive_path, 'w') if archive else contextlib.nullcontext()) as tf:
+            for clade_id, data in self.decay_indices.items():
+                if 'site_data' not in data:
+                    continue
 
-            site_data_path = output_dir / f"site_data_{clade_id}.txt"
-            with site_data_path.open('w') as f:
-                f.write(f"Site-Specific Likelihood Analysis for {clade_id}\n")
-                f.write("=" * 50 + "\n\n")
-                f.write(f"Supporting sites: {data.get('supporting_sites', 0)}\n")
-                f.write(f"Conflicting sites: {data.get('conflicting_sites', 0)}\n")
-                f.write(f"Neutral sites: {data.get('neutral_sites', 0)}\n")
-                f.write(f"Support ratio: {data.get('support_ratio', 0.0):.4f}\n")
-                f.write(f"Sum of supporting deltas: {data.get('sum_supporting_delta', 0.0):.4f}\n")
-                f.write(f"Sum of conflicting deltas: {data.get('sum_conflicting_delta', 0.0):.4f}\n")
-                f.write(f"Weighted support ratio: {data.get('weighted_support_ratio', 0.0):.4f}\n\n")
-                f.write("Site\tML_Tree_lnL\tConstrained_lnL\tDelta_lnL\tSupports_Branch\n")
-
-                # Make sure site_data is a dictionary with entries for each site
-                site_data = data.get('site_data', {})
-                if isinstance(site_data, dict) and site_data:
-                    for site_num, site_info in sorted(site_data.items()):
-                        # Safely access each field with a default
-                        ml_lnl = site_info.get('lnL_ML', 0.0)
-                        constrained_lnl = site_info.get('lnL_constrained', 0.0)
-                        delta_lnl = site_info.get('delta_lnL', 0.0)
-                        supports = site_info.get('supports_branch', False)
-
-                        f.write(f"{site_num}\t{ml_lnl:.6f}\t{constrained_lnl:.6f}\t{delta_lnl:.6f}\t{supports}\n")
-
-            logger.info(f"Detailed site data for {clade_id} written to {site_data_path}")
+                lines = [
+                    f"Site-Specific Likelihood Analysis for {clade_id}\n",
+                    "=" * 50 + "\n\n",
+                    f"Supporting sites: {data.get('supporting_sites', 0)}\n",
+                    f"Conflicting sites: {data.get('conflicting_sites', 0)}\n",
+                    f"Neutral sites: {data.get('neutral_sites', 0)}\n",
+                    f"Support ratio: {data.get('support_ratio', 0.0):.4f}\n",
+                    f"Sum of supporting deltas: {data.get('sum_supporting_delta', 0.0):.4f}\n",
+                    f"Sum of conflicting deltas: {data.get('sum_conflicting_delta', 0.0):.4f}\n",
+                    f"Weighted support ratio: {data.get('weighted_support_ratio', 0.0):.4f}\n\n",
+                    "Site\tML_Tree_lnL\tConstrained_lnL\tDelta_lnL\tSupports_Branch\n",
+                ]
+
+                # site_data is a _SITE_DATA_DTYPE record array, already sorted by site
+                site_data = data.get('site_data')
+                if site_data is not None and len(site_data):
+                    lines.extend([f"{site_num}\t{ml_lnl:.6f}\t{constrained_lnl:.6f}\t{delta_lnl:.6f}\t{supports}\n"
+                                  for site_num, ml_lnl, constrained_lnl, delta_lnl, supports in site_data.tolist()])
+
+                site_data_name = f"site_data_{clade_id}.txt"
+                if tf is not None:
+                    payload = "".join(lines).encode('utf-8')
+                    member = tarfile.TarInfo(site_data_name)
+                    member.size = len(payload)
+                    member.mtime = int(time.time())
+                    tf.addfile(member, io.BytesIO(payload))
+                    logger.debug(f"Detailed site data for {clade_id} added to {archive_path}")
+                else:
+                    site_data_path = output_dir / site_data_name
+                    with site_data_path.open('w', buffering=1 << 20) as f:
+                        f.writelines(lines)
+                    logger.info(f"Detailed site data for {clade_id} written to {site_data_path}")
+        if archive: logger.info(f"Detailed site data for all clades written to {archive_path}")
 
         # Generate site analysis visualizations
         try:
-            import matplotlib.pyplot as plt
-            import seaborn as sns
-            import numpy as np
+            if not _plotting_available(): raise ImportError("matplotlib and seaborn are required for site plots")
 
             # Get visualization options
             viz_format = getattr(self, 'viz_format', 'png')
             generate_html = getattr(self, 'generate_html', True)
-            js_cdn = getattr(self, 'js_cdn', True)
 
+            plot_tasks = [] # (clade_id, site_nums, deltas, taxa_display, info_text) per clade with site data
             for clade_id, data in self.decay_indices.items():
                 if 'site_data' not in data:
                     continue
 
                 # Extract data for plotting
-                site_data = data.get('site_data', {})
-                if not site_data:
-                    continue
-
-                site_nums = sorted(site_data.keys())
-                deltas = [site_data[site]['delta_lnL'] for site in site_nums if 'delta_lnL' in site_data[site]]
-
-                if not deltas:
+                site_data = data.get('site_data')
+                if site_data is None or not len(site_data):
                     continue
 
                 # Get taxa in this clade for visualization
@@ -1606,34 +2535,7 @@ class MLDecayIndices:
                 else:
                     taxa_display = f"{', '.join(sorted(clade_taxa)[:3])}... (+{len(clade_taxa)-3} more)"
 
-                # Create standard site analysis plot
-                fig = plt.figure(figsize=(12, 6))
-                ax_main = fig.add_subplot(111)
-
-                # Create the main bar plot
-                bar_colors = ['green' if d < 0 else 'red' for d in deltas]
-                ax_main.bar(range(len(deltas)), deltas, color=bar_colors, alpha=0.7)
-
-                # Add x-axis ticks at reasonable intervals
-                if len(site_nums) > 50:
-                    tick_interval = max(1, len(site_nums) // 20)
-                    tick_positions = range(0, len(site_nums), tick_interval)
-                    tick_labels = [site_nums[i] for i in tick_positions if i < len(site_nums)]
-                    ax_main.set_xticks(tick_positions)
-                    ax_main.set_xticklabels(tick_labels, rotation=45)
-                else:
-                    ax_main.set_xticks(range(len(site_nums)))
-                    ax_main.set_xticklabels(site_nums, rotation=45)
-
-                # Add reference line at y=0
-                ax_main.axhline(y=0, color='black', linestyle='-', alpha=0.3)
-
-                # Add title that includes some taxa information
-                ax_main.set_title(f"Site-Specific Likelihood Differences for {clade_id} ({taxa_display})")
-                ax_main.set_xlabel("Site Position")
-                ax_main.set_ylabel("Delta lnL (ML - Constrained)")
-
-                # Add summary info text box
+                # Summary info text box
                 support_ratio = data.get('support_ratio', 0.0)
                 weighted_ratio = data.get('weighted_support_ratio', 0.0)
 
@@ -1646,58 +2548,69 @@ class MLDecayIndices:
                     f"Support ratio: {ratio_text}\n"
                     f"Weighted ratio: {weighted_text}"
                 )
+                plot_tasks.append((clade_id, site_data['site'], site_data['delta_lnL'], taxa_display, info_text))
+
+            # One set of histogram bin edges spanning every clade's deltas, so edges are not
+            # recomputed per clade and the histograms share an x scale
+            hist_bins = SITE_HIST_BINS
+            if plot_tasks:
+                delta_min = min(float(task[2].min()) for task in plot_tasks)
+                delta_max = max(float(task[2].max()) for task in plot_tasks)
+                if delta_max > delta_min: hist_bins = np.linspace(delta_min, delta_max, SITE_HIST_BINS + 1)
+
+            # HTML pages are mostly file writes, so they are produced on threads while the plots render
+            html_tasks = [(clade_id, data['taxa']) for clade_id, data in self.decay_indices.items()
+                          if generate_html and data.get('taxa') and data.get('site_data') is not None and len(data['site_data'])]
+            # Clades are independent, so larger sets are drawn in worker processes, each taking a
+            # contiguous share of the clades and reusing its own figures
+            num_workers = min(len(plot_tasks), _available_cpus()) if len(plot_tasks) >= SITE_PLOT_POOL_MIN_CLADES else 1
+            plot_executor = None
+            if num_workers > 1:
+                share_size = -(-len(plot_tasks) // num_workers)
+                shares = [plot_tasks[i:i + share_size] for i in range(0, len(plot_tasks), share_size)]
+                plot_executor = concurrent.futures.ProcessPoolExecutor(max_workers=len(shares), initializer=_use_agg_backend)
+            html_executor = None
+            try:
+                if plot_executor:
+                    # Submitting forks the workers, so this happens before any HTML thread is started
+                    share_results = plot_executor.map(_render_site_plots, shares, [output_dir] * len(shares),
+                                                      [viz_format] * len(shares), [hist_bins] * len(shares))
 
-                # Add text box with summary info
-                ax_main.text(
-                    0.02, 0.95, info_text,
-                    transform=ax_main.transAxes,
-                    bbox=dict(boxstyle='round', facecolor='white', alpha=0.8)
-                )
-
-                plt.tight_layout()
-
-                # Save plot in the requested format
-                plot_path = output_dir / f"site_plot_{clade_id}.{viz_format}"
-                plt.savefig(str(plot_path), dpi=150, format=viz_format)
-                plt.close(fig)
-
-                logger.info(f"Site-specific likelihood plot for {clade_id} saved to {plot_path}")
-
-                # Optional: Create a histogram of delta values
-                plt.figure(figsize=(10, 5))
-                sns.histplot(deltas, kde=True, bins=30)
-                plt.axvline(x=0, color='black', linestyle='--')
-                plt.title(f"Distribution of Site Likelihood Differences for {clade_id}")
-                plt.xlabel("Delta lnL (ML - Constrained)")
-                plt.tight_layout()
+                html_executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(len(html_tasks), SITE_HTML_THREADS) or 1)
+                html_futures = {html_executor.submit(self.create_interactive_tree_html, output_dir, clade_id, clade_taxa): clade_id
+                                for clade_id, clade_taxa in html_tasks}
 
-                hist_path = output_dir / f"site_hist_{clade_id}.{viz_format}"
-                plt.savefig(str(hist_path), dpi=150, format=viz_format)
-                plt.close()
+                if plot_executor:
+                    written = [paths for share_paths in share_results for paths in share_paths]
+                else:
+                    written = _render_site_plots(plot_tasks, output_dir, viz_format, hist_bins)
 
-                logger.info(f"Site likelihood histogram for {clade_id} saved to {hist_path}")
+                for (clade_id, *_), (plot_path, hist_path) in zip(plot_tasks, written):
+                    logger.info(f"Site-specific likelihood plot for {clade_id} saved to {plot_path}")
+                    logger.info(f"Site likelihood histogram for {clade_id} saved to {hist_path}")
 
-                # Create interactive HTML tree visualization if enabled
-                if generate_html and clade_taxa:
-                    # Create HTML tree visualization
-                    html_path = self.create_interactive_tree_html(output_dir, clade_id, clade_taxa)
+                for future in concurrent.futures.as_completed(html_futures):
+                    html_path = future.result()
                     if html_path:
-                        logger.info(f"Interactive tree visualization for {clade_id} created at {html_path}")
-
-                if not keep_tree_files and not self.debug and not self.keep_files:
-                    for file_path in output_dir.glob("tree_*.nwk"):
-                        try:
-                            file_path.unlink()
-                            logger.debug(f"Deleted tree file for HTML: {file_path}")
-                        except Exception as e:
-                            logger.warning(f"Failed to delete tree file {file_path}: {e}")
+                        logger.info(f"Interactive tree visualization for {html_futures[future]} created at {html_path}")
+            finally:
+                if html_executor: html_executor.shutdown(wait=True)
+                if plot_executor: plot_executor.shutdown(wait=True)
+
+            # The Newick files are only needed while the HTML pages are being written
+            if not keep_tree_files and not self.debug and not self.keep_files:
+                for file_path in output_dir.glob("tree_*.nwk"):
+                    try:
+                        file_path.unlink()
+                        logger.debug(f"Deleted tree file for HTML: {file_path}")
+                    except Exception as e:
+                        logger.warning(f"Failed to delete tree file {file_path}: {e}")
 
         except ImportError:
             logger.warning("Matplotlib/seaborn not available for site analysis visualization.")
         except Exception as e:
             logger.error(f"Error creating site analysis visualizations: {e}")
             if self.debug:
-                import traceback
                 logger.debug(f"Visualization error traceback: {traceback.format_exc()}")
 
     def visualize_support_distribution(self, output_path: Path, value_type="au", **kwargs):
@@ -1743,9 +2656,6 @@ class MLDecayIndices:
             Path to the created HTML file or None if creation failed
         """
         try:
-            import json
-            from Bio import Phylo
-
             # Ensure output directory exists
             output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -1754,454 +2664,117 @@ class MLDecayIndices:
             tree_path = output_dir / f"tree_{clade_id}.nwk"
 
             # Write the ML tree to a Newick file (needed for the HTML to load)
-            Phylo.write(self.ml_tree, str(tree_path), "newick")
-
-            # Clean up the tree file if needed
-            cleaned_tree_path = self._clean_newick_tree(tree_path)
+            tree_path.write_text(self._ml_newick()) # Bio writes a single tree, nothing to clean
 
             # Get tree statistics
-            total_taxa = len(self.ml_tree.get_terminals())
+            total_taxa = self._num_taxa # Same taxa as the alignment; avoids a tree walk per clade
             highlight_ratio = len(highlight_taxa) / total_taxa if total_taxa > 0 else 0
 
+            clade_data = self.decay_indices.get(clade_id) or {} # One lookup for the site, AU and bootstrap sections
+
             # Get site analysis data if available
             site_data = None
-            if hasattr(self, 'decay_indices') and clade_id in self.decay_indices:
-                clade_data = self.decay_indices[clade_id]
-                if 'site_data' in clade_data:
-                    supporting = clade_data.get('supporting_sites', 0)
-                    conflicting = clade_data.get('conflicting_sites', 0)
-                    support_ratio = clade_data.get('support_ratio', None)
-                    if support_ratio == float('inf'):
-                        support_ratio_str = "Infinity"
-                    elif support_ratio is not None:
-                        support_ratio_str = f"{support_ratio:.2f}"
-                    else:
-                        support_ratio_str = "N/A"
+            if 'site_data' in clade_data:
+                supporting = clade_data.get('supporting_sites', 0)
+                conflicting = clade_data.get('conflicting_sites', 0)
+                support_ratio = clade_data.get('support_ratio', None)
+                if support_ratio == float('inf'):
+                    support_ratio_str = "Infinity"
+                elif support_ratio is not None:
+                    support_ratio_str = f"{support_ratio:.2f}"
+                else:
+                    support_ratio_str = "N/A"
 
-                    weighted_ratio = clade_data.get('weighted_support_ratio', None)
-                    if weighted_ratio == float('inf'):
-                        weighted_ratio_str = "Infinity"
-                    elif weighted_ratio is not None:
-                        weighted_ratio_str = f"{weighted_ratio:.2f}"
-                    else:
-                        weighted_ratio_str = "N/A"
+                weighted_ratio = clade_data.get('weighted_support_ratio', None)
+                if weighted_ratio == float('inf'):
+                    weighted_ratio_str = "Infinity"
+                elif weighted_ratio is not None:
+                    weighted_ratio_str = f"{weighted_ratio:.2f}"
+                else:
+                    weighted_ratio_str = "N/A"
 
-                    site_data = {
-                        'supporting': supporting,
-                        'conflicting': conflicting,
-                        'support_ratio': support_ratio_str,
-                        'weighted_ratio': weighted_ratio_str
-                    }
+                site_data = {
+                    'supporting': supporting,
+                    'conflicting': conflicting,
+                    'support_ratio': support_ratio_str,
+                    'weighted_ratio': weighted_ratio_str
+                }
 
             # Get AU test and likelihood data
             au_data = None
-            if hasattr(self, 'decay_indices') and clade_id in self.decay_indices:
-                clade_data = self.decay_indices[clade_id]
-                au_pvalue = clade_data.get('AU_pvalue', None)
-                lnl_diff = clade_data.get('lnl_diff', None)
-
-                if au_pvalue is not None or lnl_diff is not None:
-                    au_data = {
-                        'au_pvalue': f"{au_pvalue:.4f}" if au_pvalue is not None else "N/A",
-                        'lnl_diff': f"{lnl_diff:.4f}" if lnl_diff is not None else "N/A",
-                        'significant': clade_data.get('significant_AU', False)
-                    }
+            au_pvalue = clade_data.get('AU_pvalue')
+            lnl_diff = clade_data.get('lnl_diff')
+            if au_pvalue is not None or lnl_diff is not None:
+                au_data = {
+                    'au_pvalue': f"{au_pvalue:.4f}" if au_pvalue is not None else "N/A",
+                    'lnl_diff': f"{lnl_diff:.4f}" if lnl_diff is not None else "N/A",
+                    'significant': clade_data.get('significant_AU', False)
+                }
 
             # Get bootstrap data if available
             bootstrap_value = None
-            if hasattr(self, 'bootstrap_tree') and self.bootstrap_tree:
+            if self.has_bootstrap:
                 # Find the corresponding node in the bootstrap tree
-                for node in self.bootstrap_tree.get_nonterminals():
-                    node_taxa = set(leaf.name for leaf in node.get_terminals())
-                    if node_taxa == set(highlight_taxa):
-                        bootstrap_value = int(node.confidence) if node.confidence is not None else None
-                        break
+                taxa_key = clade_data.get('taxa_fs') or frozenset(highlight_taxa)
+                bs_confidence = self._bootstrap_values_by_taxa().get(taxa_key)
+                bootstrap_value = int(bs_confidence) if bs_confidence is not None else None
+
+            sorted_taxa = sorted(highlight_taxa) # Shared by the title, the taxa sample and the JSON list
 
             # Format taxa for title display
             if len(highlight_taxa) <= 5:
                 taxa_display = ", ".join(highlight_taxa)
             else:
-                taxa_display = f"{', '.join(sorted(highlight_taxa)[:5])}... (+{len(highlight_taxa)-5} more)"
-
-            # Start building HTML content in parts to avoid f-string backslash issues
-            # Basic structure
-            html_parts = []
-
-            # Header
-            html_parts.append("<!DOCTYPE html>")
-            html_parts.append("<html lang=\"en\">")
-            html_parts.append("<head>")
-            html_parts.append("    <meta charset=\"UTF-8\">")
-            html_parts.append("    <meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">")
-            html_parts.append(f"    <title>MLDecay - Interactive Tree for {clade_id}</title>")
-
-            # CSS
-            html_parts.append("""    <style>
-            body {
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                max-width: 1200px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            h1, h2, h3 {
-                color: #2c3e50;
-            }
-            .container {
-                display: flex;
-                flex-wrap: wrap;
-                gap: 20px;
-            }
-            .tree-section {
-                flex: 1;
-                min-width: 500px;
-            }
-            .info-section {
-                flex: 1;
-                min-width: 300px;
-                background-color: #f8f9fa;
-                padding: 15px;
-                border-radius: 5px;
-            }
-            #tree_container {
-                width: 100%;
-                height: 600px;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-                overflow: hidden;
-            }
-            .table {
-                width: 100%;
-                border-collapse: collapse;
-                margin-bottom: 15px;
-            }
-            .table th, .table td {
-                padding: 8px;
-                text-align: left;
-                border-bottom: 1px solid #ddd;
-            }
-            .table th {
-                background-color: #f2f2f2;
-            }
-            .highlight {
-                color: #e74c3c;
-                font-weight: bold;
-            }
-            .significant {
-                background-color: #d4edda;
-            }
-            .not-significant {
-                background-color: #f8d7da;
-            }
-            .buttons {
-                margin: 10px 0;
-            }
-            button {
-                background-color: #4CAF50;
-                color: white;
-                padding: 8px 12px;
-                border: none;
-                border-radius: 4px;
-                cursor: pointer;
-                margin-right: 5px;
-            }
-            button:hover {
-                background-color: #45a049;
-            }
-            .phylotree-node circle {
-                fill: #999;
-            }
-            .highlighted-node circle {
-                fill: #e74c3c !important;
-                r: 5 !important;
-            }
-            .highlighted-node text {
-                fill: #e74c3c !important;
-                font-weight: bold !important;
-            }
-            .highlighted-branch {
-                stroke: #e74c3c !important;
-                stroke-width: 3px !important;
-            }
-            .legend {
-                margin-top: 10px;
-                font-size: 0.9em;
-            }
-            .legend-item {
-                display: inline-block;
-                margin-right: 15px;
-            }
-            .legend-color {
-                display: inline-block;
-                width: 12px;
-                height: 12px;
-                margin-right: 5px;
-                vertical-align: middle;
-            }
-            .download-links {
-                margin-top: 20px;
-            }
-            .download-links a {
-                display: inline-block;
-                margin-right: 10px;
-                padding: 5px 10px;
-                background-color: #f8f9fa;
-                border: 1px solid #ddd;
-                border-radius: 3px;
-                text-decoration: none;
-                color: #333;
-            }
-            .download-links a:hover {
-                background-color: #e9ecef;
-            }
-        </style>""")
+                taxa_display = f"{', '.join(sorted_taxa[:5])}... (+{len(highlight_taxa)-5} more)"
 
-            # JavaScript imports based on CDN preference
-            use_cdn = getattr(self, 'js_cdn', True)
-            if use_cdn:
-                html_parts.append("""    <script src="https://cdnjs.cloudflare.com/ajax/libs/d3/7.8.5/d3.min.js"></script>
-        <script src="https://cdn.jsdelivr.net/npm/phylotree@1.0.0-alpha.3/dist/phylotree.js"></script>""")
-            else:
-                html_parts.append("""    <!-- Embedded D3 and Phylotree libraries would go here -->
-        <!-- This would make the file much larger -->""")
-
-            html_parts.append("</head>")
-            html_parts.append("<body>")
-
-            # Body content
-            html_parts.append(f"    <h1>MLDecay - Interactive Tree Visualization</h1>")
-            html_parts.append(f"    <h2>Clade: {clade_id} - {taxa_display}</h2>")
-
-            html_parts.append("    <div class=\"container\">")
-            html_parts.append("        <div class=\"tree-section\">")
-            html_parts.append("            <div class=\"buttons\">")
-            html_parts.append("                <button onclick=\"tree.spacing_x(100).spacing_y(20).update()\">Expand Tree</button>")
-            html_parts.append("                <button onclick=\"tree.spacing_x(30).spacing_y(10).update()\">Compact Tree</button>")
-            html_parts.append("                <button onclick=\"resetTree()\">Reset View</button>")
-            html_parts.append("                <button onclick=\"toggleLabels()\">Toggle Labels</button>")
-            html_parts.append("            </div>")
-            html_parts.append("            <div id=\"tree_container\"></div>")
-            html_parts.append("            <div class=\"legend\">")
-            html_parts.append("                <div class=\"legend-item\">")
-            html_parts.append("                    <span class=\"legend-color\" style=\"background-color: #e74c3c;\"></span>")
-            html_parts.append("                    <span>Highlighted Clade</span>")
-            html_parts.append("                </div>")
-            html_parts.append("                <div class=\"legend-item\">")
-            html_parts.append("                    <span class=\"legend-color\" style=\"background-color: #999;\"></span>")
-            html_parts.append("                    <span>Other Nodes</span>")
-            html_parts.append("                </div>")
-            html_parts.append("            </div>")
-            html_parts.append("        </div>")
-
-            # Info section
-            html_parts.append("        <div class=\"info-section\">")
-            html_parts.append("            <h3>Clade Information</h3>")
-            html_parts.append("            <table class=\"table\">")
-            html_parts.append(f"                <tr><th>Number of Taxa:</th><td>{len(highlight_taxa)} of {total_taxa} ({highlight_ratio:.1%})</td></tr>")
-
-            taxa_sample = ", ".join(sorted(highlight_taxa)[:10])
+            taxa_sample = ", ".join(sorted_taxa[:10])
             if len(highlight_taxa) > 10:
                 taxa_sample += " ..."
-            html_parts.append(f"                <tr><th>Taxa:</th><td>{taxa_sample}</td></tr>")
 
-            # Bootstrap value if available
+            # Optional rows and sections, each starting on a new line
+            bootstrap_row = ""
             if bootstrap_value is not None:
-                html_parts.append(f"                <tr><th>Bootstrap Support:</th><td>{bootstrap_value}%</td></tr>")
-
-            html_parts.append("            </table>")
+                bootstrap_row = f"\n                <tr><th>Bootstrap Support:</th><td>{bootstrap_value}%</td></tr>"
 
-            # Branch support section if available
+            branch_support = ""
             if au_data:
-                html_parts.append("            <h3>Branch Support</h3>")
-                html_parts.append("            <table class=\"table\">")
-
                 significance_class = 'significant' if au_data.get('significant') else 'not-significant'
                 significance_text = '(significant)' if au_data.get('significant') else '(not significant)'
-                html_parts.append(f"                <tr><th>AU Test p-value:</th><td class=\"{significance_class}\">{au_data['au_pvalue']} {significance_text}</td></tr>")
-                html_parts.append(f"                <tr><th>Log-Likelihood Difference:</th><td>{au_data['lnl_diff']}</td></tr>")
-
-                html_parts.append("            </table>")
+                branch_support = (
+                    "\n            <h3>Branch Support</h3>"
+                    "\n            <table class=\"table\">"
+                    f"\n                <tr><th>AU Test p-value:</th><td class=\"{significance_class}\">{au_data['au_pvalue']} {significance_text}</td></tr>"
+                    f"\n                <tr><th>Log-Likelihood Difference:</th><td>{au_data['lnl_diff']}</td></tr>"
+                    "\n            </table>"
+                )
 
-            # Site analysis section if available
+            site_analysis = ""
             if site_data:
-                html_parts.append("            <h3>Site Analysis</h3>")
-                html_parts.append("            <table class=\"table\">")
-                html_parts.append(f"                <tr><th>Supporting Sites:</th><td>{site_data['supporting']}</td></tr>")
-                html_parts.append(f"                <tr><th>Conflicting Sites:</th><td>{site_data['conflicting']}</td></tr>")
-                html_parts.append(f"                <tr><th>Support Ratio:</th><td>{site_data['support_ratio']}</td></tr>")
-                html_parts.append(f"                <tr><th>Weighted Support Ratio:</th><td>{site_data['weighted_ratio']}</td></tr>")
-                html_parts.append("            </table>")
-
-            # Download section
-            html_parts.append("            <h3>Downloads</h3>")
-            html_parts.append("            <div class=\"download-links\">")
-            html_parts.append(f"                <a href=\"{tree_path.name}\" download>Download Newick Tree</a>")
-            html_parts.append("                <a href=\"#\" onclick=\"saveSvg()\">Download SVG</a>")
-            html_parts.append("            </div>")
-            html_parts.append("        </div>")
-            html_parts.append("    </div>")
-
-            # JavaScript section
-            html_parts.append("    <script>")
-            html_parts.append(f"        // Taxa to highlight")
-            html_parts.append(f"        const highlightTaxa = {json.dumps(list(highlight_taxa))};")
-            html_parts.append("")
-            html_parts.append("        // Create tree")
-            tree_path_js = str(tree_path.name).replace('\\', '/')
-            html_parts.append(f"        let tree = new phylotree.phylotree(\"{tree_path_js}\");")
-            html_parts.append("        let showLabels = true;")
-            html_parts.append("")
-            html_parts.append("        // Initialize visualization on page load")
-            html_parts.append("        document.addEventListener(\"DOMContentLoaded\", function() {")
-            html_parts.append("            loadAndDisplayTree();")
-            html_parts.append("        });")
-            html_parts.append("")
-            html_parts.append("        function loadAndDisplayTree() {")
-            html_parts.append(f"            fetch(\"{tree_path_js}\").then(response => {{")
-            html_parts.append("                if (response.ok) {")
-            html_parts.append("                    return response.text();")
-            html_parts.append("                }")
-            html_parts.append("                throw new Error('Tree file not found');")
-            html_parts.append("            })")
-            html_parts.append("            .then(treeData => {")
-            html_parts.append("                // Set up tree visualization")
-            html_parts.append("                tree = new phylotree.phylotree(treeData);")
-            html_parts.append("")
-            html_parts.append("                // Configure tree display settings")
-            html_parts.append("                tree.branch_length(null)  // Use branch lengths from the tree")
-            html_parts.append("                    .branch_name(function(node) {")
-            html_parts.append("                        return node.data.name;")
-            html_parts.append("                    })")
-            html_parts.append("                    .node_span(function(node) {")
-            html_parts.append("                        return showLabels ? 5 : 2;")
-            html_parts.append("                    })")
-            html_parts.append("                    .node_circle_size(function(node) {")
-            html_parts.append("                        return isHighlighted(node) ? 5 : 3;")
-            html_parts.append("                    })")
-            html_parts.append("                    .font_size(14)")
-            html_parts.append("                    .scale_bar_font_size(12)")
-            html_parts.append("                    .node_styler(nodeStyler)")
-            html_parts.append("                    .branch_styler(branchStyler)")
-            html_parts.append("                    .layout_handler(phylotree.layout_handlers.radial)")
-            html_parts.append("                    .spacing_x(40) // Controls horizontal spacing")
-            html_parts.append("                    .spacing_y(15) // Controls vertical spacing")
-            html_parts.append("                    .size([550, 550])")
-            html_parts.append("                    .radial(false); // Start with rectangular layout")
-            html_parts.append("")
-            html_parts.append("                // Get the container")
-            html_parts.append("                let container = document.getElementById('tree_container');")
-            html_parts.append("")
-            html_parts.append("                // Render the tree")
-            html_parts.append("                tree.render(\"#tree_container\");")
-            html_parts.append("            })")
-            html_parts.append("            .catch(error => {")
-            html_parts.append("                console.error(\"Error loading tree data:\", error);")
-            html_parts.append("                document.getElementById('tree_container').innerHTML =")
-            html_parts.append("                    \"<p style='color:red;padding:20px;'>Error loading tree data. Check console for details.</p>\";")
-            html_parts.append("            });")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Style branches that belong to the highlighted clade")
-            html_parts.append("        function branchStyler(dom_element, link_data) {")
-            html_parts.append("            if (isHighlighted(link_data.target)) {")
-            html_parts.append("                dom_element.style.stroke = \"#e74c3c\";")
-            html_parts.append("                dom_element.style.strokeWidth = \"3px\";")
-            html_parts.append("                dom_element.classList.add(\"highlighted-branch\");")
-            html_parts.append("            }")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Style nodes that belong to the highlighted clade")
-            html_parts.append("        function nodeStyler(dom_element, node_data) {")
-            html_parts.append("            if (isHighlighted(node_data)) {")
-            html_parts.append("                dom_element.classList.add(\"highlighted-node\");")
-            html_parts.append("            }")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Check if a node belongs to the highlighted clade")
-            html_parts.append("        function isHighlighted(node) {")
-            html_parts.append("            if (!node.data) return false;")
-            html_parts.append("")
-            html_parts.append("            // Directly check leaf nodes")
-            html_parts.append("            if (node.children && node.children.length === 0) {")
-            html_parts.append("                return highlightTaxa.includes(node.data.name);")
-            html_parts.append("            }")
-            html_parts.append("")
-            html_parts.append("            // For internal nodes, check if all descendants are in the highlighted taxa")
-            html_parts.append("            let leaves = getAllLeaves(node);")
-            html_parts.append("            let leafNames = leaves.map(leaf => leaf.data.name);")
-            html_parts.append("")
-            html_parts.append("            if (leafNames.length === 0) return false;")
-            html_parts.append("")
-            html_parts.append("            // Check if this node represents exactly our clade")
-            html_parts.append("            // or is contained within our clade")
-            html_parts.append("            return leafNames.every(name => highlightTaxa.includes(name));")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Get all leaves (terminal nodes) descending from a node")
-            html_parts.append("        function getAllLeaves(node) {")
-            html_parts.append("            if (!node.children || node.children.length === 0) {")
-            html_parts.append("                return [node];")
-            html_parts.append("            }")
-            html_parts.append("")
-            html_parts.append("            let leaves = [];")
-            html_parts.append("            for (let child of node.children) {")
-            html_parts.append("                leaves = leaves.concat(getAllLeaves(child));")
-            html_parts.append("            }")
-            html_parts.append("            return leaves;")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Reset tree to default view")
-            html_parts.append("        function resetTree() {")
-            html_parts.append("            tree.spacing_x(40)")
-            html_parts.append("                .spacing_y(15)")
-            html_parts.append("                .radial(false)")
-            html_parts.append("                .update();")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Toggle display of leaf labels")
-            html_parts.append("        function toggleLabels() {")
-            html_parts.append("            showLabels = !showLabels;")
-            html_parts.append("            tree.node_span(function(node) {")
-            html_parts.append("                return showLabels ? 5 : 2;")
-            html_parts.append("            }).update();")
-            html_parts.append("        }")
-            html_parts.append("")
-            html_parts.append("        // Save tree as SVG")
-            html_parts.append("        function saveSvg() {")
-            html_parts.append("            let svg = document.querySelector(\"#tree_container svg\");")
-            html_parts.append("            let serializer = new XMLSerializer();")
-            html_parts.append("            let source = serializer.serializeToString(svg);")
-            html_parts.append("")
-            html_parts.append("            // Add name spaces")
-            html_parts.append("            if (!source.match(/^<svg[^>]+xmlns=\"http:\\/\\/www\\.w3\\.org\\/2000\\/svg\"/)) {")
-            html_parts.append("                source = source.replace(/^<svg/, '<svg xmlns=\"http://www.w3.org/2000/svg\"');")
-            html_parts.append("            }")
-            html_parts.append("            if (!source.match(/^<svg[^>]+\"http:\\/\\/www\\.w3\\.org\\/1999\\/xlink\"/)) {")
-            html_parts.append("                source = source.replace(/^<svg/, '<svg xmlns:xlink=\"http://www.w3.org/1999/xlink\"');")
-            html_parts.append("            }")
-            html_parts.append("")
-            html_parts.append("            // Add XML declaration")
-            html_parts.append("            source = '<?xml version=\"1.0\" standalone=\"no\"?>\\r\\n' + source;")
-            html_parts.append("")
-            html_parts.append("            // Create download link")
-            html_parts.append("            let downloadLink = document.createElement(\"a\");")
-            html_parts.append("            downloadLink.href = \"data:image/svg+xml;charset=utf-8,\" + encodeURIComponent(source);")
-            html_parts.append(f"            downloadLink.download = \"tree_{clade_id}.svg\";")
-            html_parts.append("            document.body.appendChild(downloadLink);")
-            html_parts.append("            downloadLink.click();")
-            html_parts.append("            document.body.removeChild(downloadLink);")
-            html_parts.append("        }")
-            html_parts.append("    </script>")
-            html_parts.append("</body>")
-            html_parts.append("</html>")
-
-            # Join all parts into the complete HTML
-            html_content = "\n".join(html_parts)
-
-            # Write the HTML file
-            with open(html_path, 'w') as f:
-                f.write(html_content)
+                site_analysis = (
+                    "\n            <h3>Site Analysis</h3>"
+                    "\n            <table class=\"table\">"
+                    f"\n                <tr><th>Supporting Sites:</th><td>{site_data['supporting']}</td></tr>"
+                    f"\n                <tr><th>Conflicting Sites:</th><td>{site_data['conflicting']}</td></tr>"
+                    f"\n                <tr><th>Support Ratio:</th><td>{site_data['support_ratio']}</td></tr>"
+                    f"\n                <tr><th>Weighted Support Ratio:</th><td>{site_data['weighted_ratio']}</td></tr>"
+                    "\n            </table>"
+                )
+
+            html_content = _HTML_TREE_TEMPLATE.substitute(
+                clade_id=clade_id,
+                taxa_display=taxa_display,
+                taxa_count=f"{len(highlight_taxa)} of {total_taxa} ({highlight_ratio:.1%})",
+                taxa_sample=taxa_sample,
+                bootstrap_row=bootstrap_row,
+                branch_support=branch_support,
+                site_analysis=site_analysis,
+                tree_file=tree_path.name,
+                highlight_taxa_json=_json_dumps(sorted_taxa),
+                js_imports=_HTML_JS_CDN if getattr(self, 'js_cdn', True) else _HTML_JS_EMBEDDED,
+            )
+
+            # Write the HTML file in one call; the page declares UTF-8, so encode explicitly
+            html_path.write_bytes(html_content.encode('utf-8'))
 
             logger.info(f"Created interactive tree visualization for {clade_id}: {html_path}")
             return html_path
@@ -2209,7 +2782,6 @@ class MLDecayIndices:
         except Exception as e:
             logger.error(f"Failed to create interactive tree visualization for {clade_id}: {e}")
             if self.debug:
-                import traceback
                 logger.debug(f"Traceback: {traceback.format_exc()}")
             return None
 
@@ -2227,30 +2799,65 @@ class MLDecayIndices:
         # Delete files explicitly marked for cleanup
         for file_path in self._files_to_cleanup:
             try:
-                if file_path.exists():
-                    file_path.unlink()
-                    logger.debug(f"Deleted intermediate file: {file_path}")
-            except Exception as e:
+                file_path.unlink(missing_ok=True) # No separate exists() stat
+                logger.debug(f"Deleted intermediate file: {file_path}")
+            except OSError as e:
                 logger.warning(f"Failed to delete intermediate file {file_path}: {e}")
 
-        # Clean up other known intermediate files
-        intermediate_patterns = [
-            "*.cleaned",  # Cleaned tree files
-            "constraint_tree_*.tre",  # Constraint trees
-            "site_lnl_*.txt",  # Site likelihood files
-            "ml_tree_for_*_annotation.nwk",  # Temporary annotation tree files
-        ]
-
-        for pattern in intermediate_patterns:
-            for file_path in self.temp_path.glob(pattern):
+        # Clean up other known intermediate files (one scan for all _INTERMEDIATE_FILE_PATTERNS)
+        with os.scandir(self.temp_path) as entries:
+            for entry in entries:
+                if not _INTERMEDIATE_FILE_RE.match(entry.name):
+                    continue
                 try:
-                    file_path.unlink()
-                    logger.debug(f"Deleted intermediate file: {file_path}")
-                except Exception as e:
-                    logger.warning(f"Failed to delete intermediate file {file_path}: {e}")
+                    os.unlink(entry.path)
+                    logger.debug(f"Deleted intermediate file: {entry.path}")
+                except OSError as e:
+                    logger.warning(f"Failed to delete intermediate file {entry.path}: {e}")
+
+    @staticmethod
+    def read_paup_block(paup_block_file_path: Path):
+        """
+        Returns the commands between "BEGIN PAUP;" and "END;" (case-insensitive), or None if absent.
+        The file is streamed line by line, so only the block itself is held in memory.
+        """
+        if not paup_block_file_path.is_file():
+            logger.error(f"PAUP block file not found: {paup_block_file_path}")
+            return None
+        try:
+            inside = False # State: seeking BEGIN PAUP, or collecting commands until END
+            buf = []
+            with open(paup_block_file_path, 'r', buffering=1 << 16) as f:
+                for line in f:
+                    if not inside:
+                        begin = _PAUP_BLOCK_BEGIN_RE.search(line)
+                        if not begin:
+                            continue
+                        inside = True
+                        line = line[begin.end():] # Commands, even END, may follow on the BEGIN line
+                    end = _PAUP_BLOCK_END_RE.search(line)
+                    if end: # e.g. "lscores 1; end;" or "END; [comment]"
+                        buf.append(line[:end.start()])
+                        paup_cmds = ''.join(buf).strip()
+                        if not paup_cmds: logger.warning(f"PAUP block in {paup_block_file_path} is empty.")
+                        return paup_cmds
+                    buf.append(line)
+            logger.error(f"No valid PAUP block (BEGIN PAUP; ... END;) in {paup_block_file_path}")
+            return None
+        except Exception as e:
+            logger.error(f"Error reading PAUP block file {paup_block_file_path}: {e}")
+            return None
 
 
 # --- Main Execution Logic ---
+def _set_debug_log_target(debug_handler, log_path: Path):
+    """Points the buffered --debug handler at log_path and writes out what it has buffered so far."""
+    fh = logging.FileHandler(log_path, mode='w', encoding='utf-8') # Overwrite for each run
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    debug_handler.setTarget(fh)
+    debug_handler.flush()
+
+
 def print_runtime_parameters(args_ns, model_str_for_print):
     """Prints a summary of runtime parameters."""
     # (args_ns is the namespace from argparse.ArgumentParser)
@@ -2268,6 +2875,12 @@ def print_runtime_parameters(args_ns, model_str_for_print):
         # Further model details can be extracted from args_ns if needed
     print(f"\n  PAUP* executable:   {args_ns.paup}")
     print(f"  Threads for PAUP*:  {args_ns.threads}")
+    if args_ns.jobs > 1:
+        print(f"  Concurrent jobs:    {args_ns.jobs}")
+    if args_ns.persistent_paup:
+        print(f"  Persistent PAUP*:   Yes")
+    if args_ns.batch_constraints:
+        print(f"  Constraint batch:   One PAUP* script")
     if args_ns.starting_tree:
         print(f"  Starting tree:      {args_ns.starting_tree}")
     output_p = Path(args_ns.output) # Use Path for consistent name generation
@@ -2276,8 +2889,9 @@ def print_runtime_parameters(args_ns, model_str_for_print):
     print(f"  Annotated trees:    {args_ns.tree}_au.nwk, {args_ns.tree}_lnl.nwk, {args_ns.tree}_combined.nwk")
     print(f"  Detailed report:    {output_p.with_suffix('.md')}")
     if args_ns.temp: print(f"  Temp directory:     {args_ns.temp}")
-    if args_ns.debug: print(f"  Debug mode:         Enabled (log: mldecay_debug.log, if configured)")
+    if args_ns.debug: print(f"  Debug mode:         Enabled (log: {DEBUG_LOG_FN} in the temporary directory)")
     if args_ns.keep_files: print(f"  Keep temp files:    Enabled")
+    if args_ns.site_analysis and args_ns.site_archive: print(f"  Site data tables:   {SITE_DATA_ARCHIVE_FN} in the site analysis directory")
     if args_ns.visualize:
         print("\nVISUALIZATIONS:")
         print(f"  Enabled, format:    {args_ns.viz_format}")
@@ -2288,26 +2902,6 @@ def print_runtime_parameters(args_ns, model_str_for_print):
             print(f"  HTML trees:         Disabled")
     print("\n" + "=" * 80 + "\n")
 
-    @staticmethod
-    def read_paup_block(paup_block_file_path: Path):
-        if not paup_block_file_path.is_file():
-            logger.error(f"PAUP block file not found: {paup_block_file_path}")
-            return None
-        try:
-            content = paup_block_file_path.read_text()
-            # Regex captures content *between* "BEGIN PAUP;" and "END;" (case-insensitive)
-            match = re.search(r'BEGIN\s+PAUP\s*;(.*?)\s*END\s*;', content, re.DOTALL | re.IGNORECASE)
-            if match:
-                paup_cmds = match.group(1).strip()
-                if not paup_cmds: logger.warning(f"PAUP block in {paup_block_file_path} is empty.")
-                return paup_cmds
-            else:
-                logger.error(f"No valid PAUP block (BEGIN PAUP; ... END;) in {paup_block_file_path}")
-                return None
-        except Exception as e:
-            logger.error(f"Error reading PAUP block file {paup_block_file_path}: {e}")
-            return None
-
 
 def main():
     parser = argparse.ArgumentParser(
@@ -2325,6 +2919,8 @@ def main():
     parser.add_argument("--output", default="ml_decay_indices.txt", help="Output file for summary results.")
     parser.add_argument("--tree", default="annotated_tree", help="Base name for annotated tree files. Three trees will be generated with suffixes: _au.nwk (AU p-values), _lnl.nwk (likelihood differences), and _combined.nwk (both values).")
     parser.add_argument("--site-analysis", action="store_true", help="Perform site-specific likelihood analysis to identify supporting/conflicting sites for each branch.")
+    parser.add_argument("--no-au-test", action="store_true", help="Skip the AU test and report likelihood differences only (no AU p-values).")
+    parser.add_argument("--site-archive", action="store_true", help=f"With --site-analysis, store the per-clade site tables in one {SITE_DATA_ARCHIVE_FN} file instead of one file per clade.")
     parser.add_argument("--data-type", default="dna", choices=["dna", "protein", "discrete"], help="Type of sequence data.")
     # Model parameter overrides
     mparams = parser.add_argument_group('Model Parameter Overrides (optional)')
@@ -2338,6 +2934,9 @@ def main():
 
     run_ctrl = parser.add_argument_group('Runtime Control')
     run_ctrl.add_argument("--threads", default="auto", help="Number of threads for PAUP* (e.g., 4 or 'auto').")
+    run_ctrl.add_argument("--jobs", type=int, default=1, help="Number of constraint searches to run concurrently; PAUP* threads are divided between them.")
+    run_ctrl.add_argument("--persistent-paup", action="store_true", help="Reuse one PAUP* process per job for the ML search, bootstrap and constraint searches instead of starting PAUP* for each run.")
+    run_ctrl.add_argument("--batch-constraints", action="store_true", help="Run all constraint searches sequentially from one generated PAUP* script (one process, full thread count; ignores --jobs).")
     run_ctrl.add_argument("--starting-tree", help="Path to a user-provided starting tree file (Newick).")
     run_ctrl.add_argument("--paup-block", help="Path to file with custom PAUP* commands for model/search setup (overrides most model args).")
     run_ctrl.add_argument("--temp", help="Custom directory for temporary files (default: system temp).")
@@ -2348,6 +2947,7 @@ def main():
     bootstrap_opts = parser.add_argument_group('Bootstrap Analysis (optional)')
     bootstrap_opts.add_argument("--bootstrap", action="store_true", help="Perform bootstrap analysis to calculate support values.")
     bootstrap_opts.add_argument("--bootstrap-reps", type=int, default=100, help="Number of bootstrap replicates (default: 100)")
+    bootstrap_opts.add_argument("--bootstrap-fixed-pinvar", action="store_true", help="With an estimated +I, estimate the proportion of invariable sites once on the ML tree and hold it fixed in every bootstrap replicate. Changes the bootstrap model.")
 
     viz_opts = parser.add_argument_group('Visualization Output (optional)')
     viz_opts.add_argument("--visualize", action="store_true", help="Generate static visualization plots (requires matplotlib, seaborn).")
@@ -2359,41 +2959,40 @@ def main():
     parser.add_argument("-v", "--version", action="version", version=f"%(prog)s {VERSION}")
     args = parser.parse_args()
 
+    debug_handler = None
     if args.debug:
         logger.setLevel(logging.DEBUG)
-        # Setup a dedicated debug file handler
-        debug_log_path = Path.cwd() / "mldecay_debug.log" # Or in temp_path once it's known
-        fh = logging.FileHandler(debug_log_path, mode='w') # Overwrite for each run
-        fh.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
-        logger.info(f"Debug logging enabled. Detailed log: {debug_log_path}")
+        # Records are buffered, and held until the temporary directory for the log file exists
+        debug_handler = logging.handlers.MemoryHandler(capacity=4096, flushLevel=logging.ERROR)
+        debug_handler.setLevel(logging.DEBUG)
+        logger.addHandler(debug_handler)
+        logger.info(f"Debug logging enabled. Detailed log: {DEBUG_LOG_FN} in the temporary directory")
         args.keep_files = True # Debug implies keeping files
 
+
     # Construct full model string for display and internal use if not using paup_block
     effective_model_str = args.model
     if args.gamma: effective_model_str += "+G"
     if args.invariable: effective_model_str += "+I"
     # Adjust for protein/discrete if base model is not specific enough
-    if args.data_type == "protein" and not args.protein_model and not any(pm in args.model.upper() for pm in ["JTT", "WAG", "LG", "DAYHOFF"]):
+    if args.data_type == "protein" and not args.protein_model and _PROTEIN_MODELS.isdisjoint(args.model.upper().split('+')):
         logger.info(f"Protein data with generic model '{args.model}'. Effective model might default to JTT within PAUP* settings.")
         # effective_model_str might be JTT+G+I if G/I are on
     elif args.data_type == "discrete" and "MK" not in args.model.upper():
         logger.info(f"Discrete data with non-Mk model '{args.model}'. Effective model might default to Mk within PAUP* settings.")
 
-    paup_block_content = None
-    if args.paup_block:
-        pbf_path = Path(args.paup_block)
-        logger.info(f"Reading PAUP block from: {pbf_path}")
-        paup_block_content = MLDecayIndices.read_paup_block(pbf_path)
-        if paup_block_content is None: # Handles not found or invalid block
-            logger.error("Failed to read or validate PAUP block file. Exiting.")
-            sys.exit(1)
+    try: # Early exits also run the finally below, so a --debug log is never dropped
+        paup_block_content = None
+        if args.paup_block:
+            pbf_path = Path(args.paup_block)
+            logger.info(f"Reading PAUP block from: {pbf_path}")
+            paup_block_content = MLDecayIndices.read_paup_block(pbf_path)
+            if paup_block_content is None: # Handles not found or invalid block
+                logger.error("Failed to read or validate PAUP block file. Exiting.")
+                sys.exit(1)
 
-    print_runtime_parameters(args, effective_model_str)
+        print_runtime_parameters(args, effective_model_str)
 
-    try:
         # Convert string paths from args to Path objects for MLDecayIndices
         temp_dir_path = Path(args.temp) if args.temp else None
         starting_tree_path = Path(args.starting_tree) if args.starting_tree else None
@@ -2413,8 +3012,13 @@ def main():
             base_freq=args.base_freq, rates=args.rates,
             protein_model=args.protein_model, nst=args.nst,
             parsmodel=args.parsmodel, # Pass the BooleanOptionalAction value
-            paup_block=paup_block_content
+            paup_block=paup_block_content,
+            jobs=args.jobs,
+            persistent_paup=args.persistent_paup,
+            batch_constraints=args.batch_constraints,
+            bootstrap_fixed_pinvar=args.bootstrap_fixed_pinvar
         )
+        if debug_handler: _set_debug_log_target(debug_handler, decay_calc.temp_path / DEBUG_LOG_FN)
 
         decay_calc.build_ml_tree() # Can raise exceptions
 
@@ -2424,16 +3028,7 @@ def main():
                 logger.info(f"Running bootstrap analysis with {args.bootstrap_reps} replicates...")
                 decay_calc.run_bootstrap_analysis(num_replicates=args.bootstrap_reps)
 
-            decay_calc.calculate_decay_indices(perform_site_analysis=args.site_analysis)
-
-            # Add this new code snippet here
-            if hasattr(decay_calc, 'decay_indices') and decay_calc.decay_indices:
-                for clade_id, data in decay_calc.decay_indices.items():
-                    if 'site_data' in data:
-                        site_output_dir = Path(args.output).parent / f"{Path(args.output).stem}_site_analysis"
-                        decay_calc.write_site_analysis_results(site_output_dir)
-                        logger.info(f"Site-specific analysis results written to {site_output_dir}")
-                        break  # Only need to do this once if any site_data exists
+            decay_calc.calculate_decay_indices(perform_site_analysis=args.site_analysis, compute_au=not args.no_au_test)
 
             output_main_path = Path(args.output)
             decay_calc.write_results(output_main_path)
@@ -2457,9 +3052,8 @@ def main():
                 viz_base_name = output_main_path.stem
                 viz_kwargs = {'width': 10, 'height': 6, 'format': args.viz_format}
 
-                # Check for viz library availability early
-                try: import matplotlib, seaborn
-                except ImportError:
+                # Check for viz library availability early; the plotting methods import them when drawing
+                if not _plotting_available():
                     logger.warning("Matplotlib/Seaborn not installed. Skipping static visualizations.")
                     args.visualize = False # Disable further attempts
 
@@ -2468,16 +3062,18 @@ def main():
                         viz_out_dir / f"{viz_base_name}_dist_{args.annotation}.{args.viz_format}",
                         value_type=args.annotation, **viz_kwargs)
 
-                if args.site_analysis:
+                if args.site_analysis and args.visualize:
                     # Pass visualization preferences to the MLDecayIndices instance
-                    if args.visualize:
-                        decay_calc.generate_html = args.html_trees
-                        decay_calc.js_cdn = args.js_cdn
-                        decay_calc.viz_format = args.viz_format
+                    decay_calc.generate_html = args.html_trees
+                    decay_calc.js_cdn = args.js_cdn
+                    decay_calc.viz_format = args.viz_format
 
-                    site_output_dir = output_main_path.parent / f"{output_main_path.stem}_site_analysis"
-                    decay_calc.write_site_analysis_results(site_output_dir, keep_tree_files=args.keep_tree_files)
-                    logger.info(f"Site-specific analysis results written to {site_output_dir}")
+            # Written once, after the visualization preferences are known
+            if args.site_analysis and any('site_data' in data for data in decay_calc.decay_indices.values()):
+                site_output_dir = output_main_path.parent / f"{output_main_path.stem}_site_analysis"
+                decay_calc.write_site_analysis_results(site_output_dir, keep_tree_files=args.keep_tree_files,
+                                                       archive=args.site_archive)
+                logger.info(f"Site-specific analysis results written to {site_output_dir}")
 
             decay_calc.cleanup_intermediate_files()
             logger.info("MLDecay analysis completed successfully.")
@@ -2488,16 +3084,20 @@ def main():
     except Exception as e:
         logger.error(f"MLDecay analysis terminated with an error: {e}")
         if args.debug: # Print traceback in debug mode
-            import traceback
             logger.debug("Full traceback:\n%s", traceback.format_exc())
         sys.exit(1)
 
     finally:
         # This block executes whether try succeeds or fails.
+        if 'decay_calc' in locals(): decay_calc.close_paup_sessions()
         # If decay_calc was initialized and keep_files is false, __del__ will handle cleanup.
         # If __init__ failed before self.temp_path was set, no specific cleanup here yet.
         if 'decay_calc' in locals() and (args.debug or args.keep_files):
             logger.info(f"Temporary files are preserved in: {decay_calc.temp_path}")
+        if debug_handler:
+            if debug_handler.target is None: # Failed before the temporary directory was set up
+                _set_debug_log_target(debug_handler, Path.cwd() / DEBUG_LOG_FN)
+            debug_handler.flush()
 
 
 if __name__ == "__main__":
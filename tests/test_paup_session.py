@@ -0,0 +1,70 @@
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from MLDecay import PaupSession  # noqa: E402
+
+
+def _fake_paup(tmp_path, flush):
+    """Writes a stand-in for PAUP* -n that echoes "[!...]" comments and acknowledges other commands."""
+    script = tmp_path / ("paup_flush" if flush else "paup_buffered")
+    script.write_text(textwrap.dedent(f"""\
+        #!{sys.executable}
+        import sys, time
+        out = open(sys.stdout.fileno(), "w", buffering=1 << 16, closefd=False) # Block-buffered like a pipe
+        print("P A U P * fake", file=out)
+        for line in sys.stdin:
+            line = line.strip()
+            if line.lower() == "quit;":
+                break
+            if line == "sleep;":
+                time.sleep(60)
+            if line.startswith("[!") and line.endswith("]"):
+                print(line[2:-1], file=out)
+            elif line:
+                print("ran: " + line, file=out)
+            if {flush}:
+                out.flush()
+        """))
+    script.chmod(0o755)
+    return script
+
+
+def test_session_runs_commands_and_writes_log(tmp_path):
+    session = PaupSession(_fake_paup(tmp_path, flush=True), tmp_path, "execute alignment.nex;",
+                          tmp_path / "setup.log", timeout_sec=10, handshake_timeout_sec=10)
+    try:
+        assert session.alive
+        assert "ran: execute alignment.nex;" in (tmp_path / "setup.log").read_text()
+        tail = session.run("hsearch;\nsavetrees file=ml_tree.tre;", tmp_path / "search.log", timeout_sec=10)
+        assert "ran: hsearch;" in tail
+        log_text = (tmp_path / "search.log").read_text()
+        assert "ran: hsearch;" in log_text and "ran: savetrees file=ml_tree.tre;" in log_text
+        assert "__MLDECAY_DONE_" not in log_text
+    finally:
+        session.close()
+    assert not session.alive
+
+
+def test_session_handshake_fails_fast_on_buffered_output(tmp_path):
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="handshake"):
+        PaupSession(_fake_paup(tmp_path, flush=False), tmp_path, "execute alignment.nex;",
+                    tmp_path / "setup.log", timeout_sec=60, handshake_timeout_sec=1)
+    assert time.monotonic() - start < 30
+
+
+def test_session_run_times_out(tmp_path):
+    session = PaupSession(_fake_paup(tmp_path, flush=True), tmp_path, "", tmp_path / "setup.log",
+                          timeout_sec=10, handshake_timeout_sec=10)
+    try:
+        with pytest.raises(subprocess.TimeoutExpired):
+            session.run("sleep;", tmp_path / "stuck.log", timeout_sec=1)
+        assert not session.alive
+    finally:
+        session.close()